@@ -1,176 +1,448 @@
-import re
+import os
 import json
-import time
 import threading
-from collections import Counter, defaultdict
-from urllib.parse import urlparse
+from collections import Counter
 from datetime import datetime
 
+from utils.canonical import canonicalize
+from utils.bloom import ScalableBloomFilter
+from utils.checkpoint import append_record, read_records, rewrite_records
+from utils.content_store import ContentStore
+from utils.inverted_index import IndexBuilder
+from utils.metrics import metrics
+from utils.simhash import SimHashIndex
+from utils.topk import SpaceSaving
+from utils.parsing import STOPWORDS, parse_html
+from traps import trap_detector
+
+class PageStats:
+    ''' Word counts, subdomain counts and longest page for a set of pages.
+    
+    Each worker thread fills its own instance, so the hot path never
+    contends with other workers. The lock is only shared with merges.
+    word_counter builds the word count table, a Counter or a bounded
+    SpaceSaving summary. '''
+    def __init__(self, word_counter=Counter):
+        self.lock = threading.Lock()
+        self.word_counter = word_counter
+        self.word_counts = word_counter()
+        self.subdomain_counts = Counter()
+        self.longest_page = (None, 0)
+    
+    def add(self, normalized_url, netloc, page):
+        with self.lock:
+            if netloc:
+                self.subdomain_counts[netloc] += 1
+            if page is not None:
+                self.word_counts.update(page.tokens)
+                if page.word_count > self.longest_page[1]:
+                    self.longest_page = (normalized_url, page.word_count)
+    
+    def replace(self, normalized_url, old_tokens, page):
+        ''' Swaps the words of an earlier version of a page for its
+        current ones. A bounded summary cannot count down, so there only
+        the words the page gained are added. '''
+        delta = Counter(page.tokens)
+        delta.subtract(old_tokens)
+        if not isinstance(self.word_counts, Counter):
+            delta = +delta
+        with self.lock:
+            self.word_counts.update(
+                {word: count for word, count in delta.items() if count})
+            if page.word_count > self.longest_page[1]:
+                self.longest_page = (normalized_url, page.word_count)
+    
+    def merge(self, other):
+        self.word_counts.update(other.word_counts)
+        self.subdomain_counts.update(other.subdomain_counts)
+        if other.longest_page[1] > self.longest_page[1]:
+            self.longest_page = other.longest_page
+    
+    def drain_into(self, *targets):
+        with self.lock:
+            for target in targets:
+                target.merge(self)
+            self.clear()
+    
+    def to_record(self):
+        record = {
+            "words": dict(self.word_counts.items()),
+            "subdomains": dict(self.subdomain_counts),
+            "longest": self.longest_page}
+        if isinstance(self.word_counts, SpaceSaving):
+            record["word_error"] = self.word_counts.error_bound()
+        return record
+    
+    def merge_record(self, record):
+        if isinstance(self.word_counts, SpaceSaving):
+            self.word_counts.update(record["words"], record.get("word_error", 0))
+        else:
+            self.word_counts.update(record["words"])
+        self.subdomain_counts.update(record["subdomains"])
+        if record["longest"][1] > self.longest_page[1]:
+            self.longest_page = record["longest"]
+    
+    def clear(self):
+        self.word_counts = self.word_counter()
+        self.subdomain_counts = Counter()
+        self.longest_page = (None, 0)
+
 class CrawlerAnalyzer:
     def __init__(self):
-        self.unique_urls = set()
-        self.url_to_word_count = {}
+        # Visited pages, as a compact filter instead of a set of url strings.
+        self.unique_urls = ScalableBloomFilter()
+        self.unique_urls_path = None
+        self.unique_urls_lock = threading.Lock()
+        # Visited pages of other crawl shards merged in, see merge_shard.
+        self.shard_page_count = 0
+        # Url templates blocked in other crawl shards, see merged_analyzer.
+        self.shard_blocked_templates = []
         
-        self.subdomain_counts = defaultdict(int)
-        self.page_contents = {}
+        # Per-thread page stats, merged into totals when they are read.
+        self.local_stats = threading.local()
+        self.thread_stats = []
+        self.word_counter = Counter
+        self.totals = PageStats()
+        self.merge_lock = threading.Lock()
         
-        self.word_counts = Counter()
-        self.stopwords = self._load_stopwords()
+        # Crash-safe checkpoints: an append-only log of what changed since
+        # the previous checkpoint, compacted into one record now and then.
+        self.checkpoint_path = None
+        self.checkpoint_interval = 0
+        self.checkpoint_compact = 0
+        self.checkpoint_count = 0
+        self.checkpoint_stop = threading.Event()
+        self.checkpoint_thread = None
+        self.unsaved = PageStats()
+        # Frontier whose completed urls are committed by each checkpoint,
+        # see Frontier.hold_completions.
+        self.frontier = None
         
-        self.url_hashes = {}
-        self.content_hashes = {}
+        self.content_store = None
+        # Optional inverted index of the crawled pages' tokens.
+        self.index_builder = None
         
-        self.domain_last_request = {}
-        self.politeness_delay = None
-        self.politeness_lock = threading.Lock()
+        self.stopwords = self._load_stopwords()
+        
+        # Near-duplicate detection: SimHash index of crawled pages, and the
+        # pages skipped as near-duplicates of an earlier one.
+        self.duplicate_index = SimHashIndex()
+        self.duplicate_pages = {}
+        self.duplicate_lock = threading.Lock()
+        self.unsaved_fingerprints = []
+        self.unsaved_duplicates = {}
         
     def _load_stopwords(self):
-        stopwords_text = "a about above after again against all am an and any are aren't as at be because been before being below between both but by can't cannot could couldn't did didn't do does doesn't doing don't down during each few for from further had hadn't has hasn't have haven't having he he'd he'll he's her here here's hers herself him himself his how how's i i'd i'll i'm i've if in into is isn't it it's its itself let's me more most mustn't my myself no nor not of off on once only or other ought our ours ourselves out over own same shan't she she'd she'll she's should shouldn't so some such than that that's the their theirs them themselves then there there's these they they'd they'll they're they've this those through to under until up very was wasn't we we'd we'll we're we've were weren't what what's when when's where where's which while who who's whom why why's with won't would wouldn't you you'd you'll you're you've your yours yourself yourselves"
-        return set(stopwords_text.split())
+        return set(STOPWORDS)
     
-    def normalize_url(self, url):
-        try:
-            parsed = urlparse(url)
-            
-            if '#' in url:
-                url = url.split('#')[0]
-                parsed = urlparse(url)
-            
-            scheme = parsed.scheme.lower()
-            netloc = parsed.netloc.lower()
-            path = parsed.path
-            query = parsed.query
-            
-            if netloc.startswith('www.'):
-                netloc = netloc[4:]
-            
-            if path.endswith('/') and path != '/':
-                path = path.rstrip('/')
-            elif path == '':
-                path = '/'
-            
-            if scheme in ('http', 'https'):
-                scheme = 'https'
-            
-            normalized = f"{scheme}://{netloc}{path}"
-            if query:
-                normalized += f"?{query}"
-            
-            return normalized
-            
-        except Exception:
-            return url.split('#')[0] if '#' in url else url
+    def configure(self, config, restart):
+        if self.content_store is not None:
+            self.content_store.close()
+        self.content_store = ContentStore(
+            config.content_dir, config.content_segment_size, restart)
+        if self.index_builder is not None:
+            self.index_builder.close()
+            self.index_builder = None
+        if config.index_dir:
+            self.index_builder = IndexBuilder(
+                config.index_dir, config.index_memory, restart)
+        self.open_state(config, restart)
+    
+    def open_state(self, config, restart=False):
+        ''' Sets up the analyzer state and, unless restarting, loads the
+        visited filter and checkpoint saved next to the frontier. '''
+        self.duplicate_index = SimHashIndex(config.near_duplicate_distance)
+        if config.word_counts == "bounded":
+            self.word_counter = lambda: SpaceSaving.for_error(config.word_error)
+        else:
+            self.word_counter = Counter
+        with self.merge_lock:
+            self.thread_stats = []
+            self.local_stats = threading.local()
+            self.totals = PageStats(self.word_counter)
+            self.unsaved = PageStats(self.word_counter)
+        self.unique_urls_path = config.save_file + ".visited.bloom"
+        self.unique_urls = ScalableBloomFilter.open(
+            self.unique_urls_path, config.bloom_capacity,
+            config.bloom_error_rate, restart)
+        
+        self.checkpoint_path = config.save_file + ".analysis"
+        self.checkpoint_interval = config.checkpoint_interval
+        self.checkpoint_compact = config.checkpoint_compact
+        if restart and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.load_checkpoint(self.checkpoint_path)
+
+    def close(self):
+        self.stop_checkpoints()
+        if self.checkpoint_path is not None:
+            self.checkpoint()
+        self.frontier = None
+        if self.content_store is not None:
+            self.content_store.close()
+            self.content_store = None
+        if self.index_builder is not None:
+            with metrics.time("index_merge"):
+                self.index_builder.finish()
+            self.index_builder.close()
+            self.index_builder = None
+        if self.unique_urls_path is not None:
+            with self.unique_urls_lock:
+                self.unique_urls.save(self.unique_urls_path)
+    
+    def load_checkpoint(self, path):
+        ''' Replays a checkpoint log into the current state. '''
+        records = 0
+        for record in read_records(path):
+            self._apply_record(record)
+            records += 1
+        self.checkpoint_count = records
+        return records
     
-    def set_politeness_delay(self, delay):
-        self.politeness_delay = delay
+    def _apply_record(self, record):
+        with self.merge_lock:
+            if record.get("totals"):
+                self.totals = PageStats(self.word_counter)
+            self.totals.merge_record(record["stats"])
+        with self.duplicate_lock:
+            for fingerprint, url in record["fingerprints"]:
+                self.duplicate_index.add(fingerprint, url)
+            self.duplicate_pages.update(record["duplicates"])
+    
+    def start_checkpoints(self):
+        if self.checkpoint_interval <= 0 or self.checkpoint_thread is not None:
+            return
+        self.checkpoint_stop.clear()
+        self.checkpoint_thread = threading.Thread(
+            target=self._checkpoint_loop, daemon=True)
+        self.checkpoint_thread.start()
+    
+    def stop_checkpoints(self):
+        if self.checkpoint_thread is not None:
+            self.checkpoint_stop.set()
+            self.checkpoint_thread.join()
+            self.checkpoint_thread = None
+    
+    def _checkpoint_loop(self):
+        while not self.checkpoint_stop.wait(self.checkpoint_interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                print(f"error writing analyzer checkpoint, {e}")
+    
+    def checkpoint(self):
+        ''' Appends everything added since the last checkpoint to the log,
+        without pausing workers. Every checkpoint_compact records the log
+        is rewritten as a single record of the full state. '''
+        frontier = self.frontier
+        # Taken first: the pages of these urls are already in the statistics
+        # and visited filter saved below, so they are committed after them.
+        held = frontier.take_completions() if frontier is not None else None
+        with self.unique_urls_lock:
+            self.unique_urls.save(self.unique_urls_path)
+        with self.merge_lock:
+            self._merge_locked()
+            compact = self.checkpoint_count + 1 >= self.checkpoint_compact > 0
+            if compact or isinstance(self.totals.word_counts, SpaceSaving):
+                # Replaying summaries of the changes on resume would be one
+                # more level of merging, so bounded counts are saved whole.
+                record = {"stats": self.totals.to_record(), "totals": True}
+            else:
+                record = {"stats": self.unsaved.to_record()}
+            self.unsaved = PageStats(self.word_counter)
+        with self.duplicate_lock:
+            if compact:
+                record["fingerprints"] = list(self.duplicate_index.entries())
+                record["duplicates"] = dict(self.duplicate_pages)
+            else:
+                record["fingerprints"] = self.unsaved_fingerprints
+                record["duplicates"] = self.unsaved_duplicates
+            self.unsaved_fingerprints = []
+            self.unsaved_duplicates = {}
+        if compact:
+            if self.index_builder is not None:
+                # Bounds what a crash loses of the index, without
+                # spilling many small blocks.
+                self.index_builder.spill()
+            rewrite_records(self.checkpoint_path, [record])
+            self.checkpoint_count = 1
+        else:
+            append_record(self.checkpoint_path, record)
+            self.checkpoint_count += 1
+        if held is not None:
+            frontier.commit_completions(held)
+
+    def normalize_url(self, url):
+        return canonicalize(url).url
     
     def is_url_visited(self, url):
+        return canonicalize(url).key in self.unique_urls
+    
+    def find_duplicate(self, url, page):
+        ''' Returns the earlier page that `page` is a near-duplicate of, or
+        indexes `page` and returns None. '''
+        if page.fingerprint is None or self.duplicate_index.max_distance < 0:
+            return None
         normalized_url = self.normalize_url(url)
-        return normalized_url in self.unique_urls
+        with metrics.timed_lock(self.duplicate_lock, "duplicate_lock_wait"):
+            original = self.duplicate_index.find(page.fingerprint)
+            if original is None:
+                self.duplicate_index.add(page.fingerprint, normalized_url)
+                self.unsaved_fingerprints.append((page.fingerprint, normalized_url))
+            elif original != normalized_url:
+                self.duplicate_pages[normalized_url] = original
+                self.unsaved_duplicates[normalized_url] = original
+            else:
+                return None
+        return original
     
-    def check_domain_politeness(self, url):
-        try:
-            if self.politeness_delay is None:
-                return True
-            
-            parsed = urlparse(url)
-            domain = parsed.netloc.lower()
-            
-            if not domain:
-                return True
-            
-            with self.politeness_lock:
-                current_time = time.time()
-                last_request_time = self.domain_last_request.get(domain, 0)
-                
-                time_since_last = current_time - last_request_time
-                
-                if time_since_last < self.politeness_delay:
-                    wait_time = self.politeness_delay - time_since_last
-                    print(f"Domain politeness: waiting {wait_time:.3f}s before requesting {domain}")
-                    time.sleep(wait_time)
-                    current_time = time.time()
-                
-                self.domain_last_request[domain] = current_time
-            
-            return True
-            
-        except Exception as e:
-            print(f"error checking domain politeness, {e}")
-            return True
+    def add_page(self, url, page=None, content=None, revisit=False):
+        ''' revisit: url was added before and has changed since, so its
+        statistics, content and index entry are updated. '''
+        with metrics.time("analyzer_add_page"):
+            self._add_page(url, page, content, revisit)
     
-    def add_page(self, url, content=None):
-        normalized_url = self.normalize_url(url)
+    def _add_page(self, url, page, content, revisit=False):
+        normalized_url, netloc, _, key = canonicalize(url)
         
-        if normalized_url not in self.unique_urls:
-            self.unique_urls.add(normalized_url)
-            
-            parsed = urlparse(normalized_url)
-            if parsed.netloc:
-                self.subdomain_counts[parsed.netloc] += 1
+        with metrics.timed_lock(self.unique_urls_lock, "visited_lock_wait"):
+            is_new = self.unique_urls.add(key)
+        if is_new:
+            if netloc.startswith("www."):
+                netloc = netloc[4:]
+            self._thread_stats().add(normalized_url, netloc, page)
             
-            if content is not None:
-                self.page_contents[normalized_url] = content
-                
-                word_count, filtered_words = self.process_content(content)
-                
-                self.url_to_word_count[normalized_url] = word_count
-                
-                for word in filtered_words:
-                    self.word_counts[word] += 1
-    
-    def process_content(self, content):
-        clean_text = re.sub(r'<[^>]+>', ' ', content)
-        words = re.findall(r'\b[a-zA-Z]+\b', clean_text.lower())
-        filtered_words = [word for word in words if len(word) > 2 and word not in self.stopwords]
-        return len(words), filtered_words
+            if content is not None and self.content_store is not None:
+                with metrics.time("content_store_put"):
+                    self.content_store.put(normalized_url, content)
+            if page is not None and self.index_builder is not None:
+                with metrics.time("index_add"):
+                    self.index_builder.add(normalized_url, page.tokens)
+        elif revisit and page is not None:
+            self._refresh_page(normalized_url, page, content)
+    
+    def _refresh_page(self, normalized_url, page, content):
+        # The previous version's words are recounted from the content
+        # store; without it the old words stay counted.
+        old_content = self.get_page_content(normalized_url)
+        old_tokens = (
+            parse_html(old_content, normalized_url).tokens
+            if old_content else Counter())
+        self._thread_stats().replace(normalized_url, old_tokens, page)
+        if content is not None and self.content_store is not None:
+            with metrics.time("content_store_put"):
+                self.content_store.put(normalized_url, content)
+        if self.index_builder is not None:
+            # The index keeps the latest document of each url.
+            with metrics.time("index_add"):
+                self.index_builder.add(normalized_url, page.tokens)
+    
+    def _thread_stats(self):
+        stats = getattr(self.local_stats, "stats", None)
+        if stats is None:
+            stats = self.local_stats.stats = PageStats(self.word_counter)
+            with self.merge_lock:
+                self.thread_stats.append(stats)
+        return stats
+    
+    def merge(self):
+        ''' Folds every thread's stats into totals, without stopping the
+        workers, and returns totals. '''
+        with self.merge_lock:
+            return self._merge_locked()
+    
+    def _merge_locked(self):
+        for stats in self.thread_stats:
+            stats.drain_into(self.totals, self.unsaved)
+        return self.totals
+    
+    def get_page_content(self, url):
+        if self.content_store is None:
+            return None
+        return self.content_store.get(self.normalize_url(url))
     
     def get_unique_page_count(self):
-        return len(self.unique_urls)
+        return len(self.unique_urls) + self.shard_page_count
+    
+    def merge_shard(self, other):
+        ''' Adds the state of the analyzer of another crawl shard. Shards
+        crawl disjoint hosts, so their visited pages are added up. '''
+        with self.merge_lock:
+            self.totals.merge(other.merge())
+        self.shard_page_count += other.get_unique_page_count()
+        with self.duplicate_lock:
+            for fingerprint, url in other.duplicate_index.entries():
+                self.duplicate_index.add(fingerprint, url)
+            self.duplicate_pages.update(other.duplicate_pages)
+    
+    def get_blocked_templates(self):
+        ''' Url templates cut off as crawler traps, with how many of their
+        urls were discovered and why, see TrapDetector. '''
+        return sorted(
+            trap_detector.get_blocked_templates() + self.shard_blocked_templates)
     
     def get_longest_page(self):
-        if not self.url_to_word_count:
-            return None, 0
-        
-        longest_url = max(self.url_to_word_count, key=self.url_to_word_count.get)
-        return longest_url, self.url_to_word_count[longest_url]
+        return self.merge().longest_page
     
     def get_most_common_words(self, n=50):
-        return self.word_counts.most_common(n)
+        return self.merge().word_counts.most_common(n)
     
     def get_subdomain_stats(self):
         uci_subdomains = {}
-        for subdomain, count in self.subdomain_counts.items():
+        for subdomain, count in self.merge().subdomain_counts.items():
             if subdomain.endswith('.uci.edu'):
                 uci_subdomains[subdomain] = count
         
         return sorted(uci_subdomains.items())
     
     def reset(self):
-        self.unique_urls.clear()
-        self.url_to_word_count.clear()
-        self.subdomain_counts.clear()
-        self.page_contents.clear()
-        self.word_counts.clear()
-        self.url_hashes.clear()
-        self.content_hashes.clear()
-        self.domain_last_request.clear()
+        self.unique_urls = ScalableBloomFilter(
+            self.unique_urls.initial_capacity, self.unique_urls.error_rate)
+        self.shard_page_count = 0
+        self.shard_blocked_templates = []
+        with self.merge_lock:
+            for stats in self.thread_stats:
+                with stats.lock:
+                    stats.clear()
+            self.totals = PageStats(self.word_counter)
+            self.unsaved = PageStats(self.word_counter)
+        self.duplicate_index = SimHashIndex(self.duplicate_index.max_distance)
+        self.duplicate_pages.clear()
+        self.unsaved_fingerprints = []
+        self.unsaved_duplicates = {}
     
     def generate_report(self, output_file="crawler_report.txt"):
         report_lines = []
         
         report_lines.append(f"unique pages found: {self.get_unique_page_count()}")
         
-        report_lines.append(f"longest page: {self.get_longest_page()[0]} {self.get_longest_page()[1]}")
+        longest_url, longest_count = self.get_longest_page()
+        report_lines.append(f"longest page: {longest_url} {longest_count}")
         
         report_lines.append("50 most common words:")
         common_words = self.get_most_common_words(50)
         for i, (word, count) in enumerate(common_words, 1):
             report_lines.append(f"   {i:2d}. {word:<15} ({count} occurrences)")
+        word_counts = self.merge().word_counts
+        if isinstance(word_counts, SpaceSaving):
+            report_lines.append(
+                f"   (bounded word counts: each count is at most "
+                f"{word_counts.error_bound():.0f} too high)")
         report_lines.append("")
         
         report_lines.append(f"uci.edu subdomains: {self.get_subdomain_stats()}")
         
+        report_lines.append("")
+        report_lines.append(f"near-duplicate pages skipped: {len(self.duplicate_pages)}")
+        for url, original in sorted(self.duplicate_pages.items()):
+            report_lines.append(f"   {url} (duplicate of {original})")
+        
+        report_lines.append("")
+        blocked_templates = self.get_blocked_templates()
+        report_lines.append(f"url templates cut off as traps: {len(blocked_templates)}")
+        for template, discovered, state in blocked_templates:
+            report_lines.append(f"   {template} ({state}, {discovered} urls discovered)")
+        
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write('\n'.join(report_lines))
 
@@ -0,0 +1,162 @@
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from configparser import ConfigParser
+
+from benchmark.server import CacheServerProcess
+from benchmark.stages import StageTimer
+from benchmark.web import SyntheticWeb
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own / scale, children / scale
+
+
+def build_config(args, workdir, cache_server, web):
+    from utils.config import Config
+    cparser = ConfigParser()
+    cparser.read(args.config_file)
+    cparser["CRAWLER"]["SEEDURL"] = ",".join(web.seed_urls)
+    cparser["CRAWLER"]["POLITENESS"] = str(args.politeness)
+    local = cparser["LOCAL PROPERTIES"]
+    local["SAVE"] = os.path.join(workdir, "frontier.db")
+    local["CONTENT_DIR"] = os.path.join(workdir, "content")
+    local["THREADCOUNT"] = str(args.threads)
+    local["ENGINE"] = args.engine
+    local["PARSE_PROCESSES"] = str(args.parse_processes)
+    for option in args.set:
+        section, _, assignment = option.partition(".")
+        key, _, value = assignment.partition("=")
+        cparser[section][key] = value
+    config = Config(cparser)
+    config.cache_server = cache_server
+    return config
+
+
+def run(args):
+    web = SyntheticWeb(
+        pages=args.pages, links=args.links, seed=args.seed,
+        duplicate_rate=args.duplicates, large_rate=args.large,
+        slow_rate=args.slow, slow_delay=args.slow_delay, trap_rate=args.traps)
+    server = CacheServerProcess(web).start()
+    workdir = tempfile.mkdtemp(prefix="crawler-bench-")
+    cwd = os.getcwd()
+    config_file = os.path.abspath(args.config_file)
+    timer = StageTimer()
+    try:
+        # Logs and the report are written to the working directory.
+        os.chdir(workdir)
+        args.config_file = config_file
+        config = build_config(args, workdir, server.address, web)
+
+        import scraper
+        import crawler.worker
+        import crawler.async_worker
+        from crawler import Crawler
+        from crawler.frontier import Frontier
+        from crawler.shard import run_sharded
+        from crawler.parse_pool import parse_pool
+        timer.wrap(crawler.worker, "download", "download")
+        timer.wrap(crawler.async_worker, "async_download", "download")
+        timer.wrap(parse_pool, "parse", "parse")
+        timer.wrap(scraper, "scraper", "scrape")
+        timer.wrap(Frontier, "add_urls", "frontier_add")
+
+        start = time.perf_counter()
+        if config.shards > 1:
+            # Shards are spawned processes, out of reach of the stage
+            # timers, so only throughput is measured.
+            run_sharded(config, True)
+        else:
+            crawler_instance = Crawler(config, True)
+            crawler_instance.start()
+        elapsed = time.perf_counter() - start
+        # Before the server process is reaped and counted as a child.
+        own_rss, children_rss = peak_rss_mb()
+    finally:
+        timer.restore()
+        os.chdir(cwd)
+        server.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    stages = timer.summary()
+    pages = stages.get("download", (0, 0, 0))[0]
+    if config.shards > 1:
+        # One cache server request per download.
+        pages = server.requests
+    return {
+        "engine": args.engine,
+        "threads": args.threads,
+        "parse_processes": args.parse_processes,
+        "shards": config.shards,
+        "site_pages": args.pages,
+        "pages": pages,
+        "requests": server.requests,
+        "seconds": elapsed,
+        "pages_per_second": pages / elapsed if elapsed else 0.0,
+        "stages": {
+            stage: {"count": count, "p50_ms": p50 * 1000, "p99_ms": p99 * 1000}
+            for stage, (count, p50, p99) in stages.items()},
+        "peak_rss_mb": own_rss,
+        "peak_child_rss_mb": children_rss,
+        "workdir": workdir if args.keep else None,
+    }
+
+
+def print_result(result):
+    print()
+    print(
+        f"engine {result['engine']}, {result['threads']} threads, "
+        f"{result['parse_processes']} parser processes, "
+        f"{result['shards']} shards")
+    print(
+        f"{result['pages']} pages in {result['seconds']:.2f}s: "
+        f"{result['pages_per_second']:.1f} pages/s")
+    print(f"{'stage':<14}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for stage, stats in sorted(result["stages"].items()):
+        print(
+            f"{stage:<14}{stats['count']:>8}"
+            f"{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    print(
+        f"peak RSS {result['peak_rss_mb']:.1f} MB "
+        f"(largest child process {result['peak_child_rss_mb']:.1f} MB)")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="python -m benchmark",
+        description="Crawl a synthetic site served by a local cache server.")
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--engine", type=str, default="threads")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--parse_processes", type=int, default=0)
+    parser.add_argument("--politeness", type=float, default=0.0)
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--links", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duplicates", type=float, default=0.05)
+    parser.add_argument("--large", type=float, default=0.01)
+    parser.add_argument("--slow", type=float, default=0.02)
+    parser.add_argument("--slow_delay", type=float, default=0.2)
+    parser.add_argument("--traps", type=float, default=0.1)
+    parser.add_argument(
+        "--set", action="append", default=[], metavar="SECTION.KEY=VALUE",
+        help="Override a config.ini option, e.g. 'LOCAL PROPERTIES.STORE=shelve'.")
+    parser.add_argument("--json", type=str, default=None, help="Also write the result here.")
+    parser.add_argument("--keep", action="store_true", default=False, help="Keep the work directory.")
+    args = parser.parse_args()
+    result = run(args)
+    print_result(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,108 @@
+import multiprocessing
+import pickle
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import cbor
+import requests
+
+
+def encode_response(url, status, html):
+    ''' Body of a cache server answer: a CBOR map holding the pickled
+    requests.Response, as utils.download expects. '''
+    raw_response = requests.Response()
+    raw_response.url = url
+    raw_response.status_code = status
+    raw_response.headers["Content-Type"] = "text/html; charset=utf-8"
+    raw_response._content = html.encode("utf-8")
+    return cbor.dumps({
+        "url": url, "status": status,
+        "response": pickle.dumps(raw_response, pickle.HIGHEST_PROTOCOL)})
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        url = query.get("q", [""])[0]
+        status, html, delay = self.server.web.page(url)
+        if delay:
+            time.sleep(delay)
+        body = encode_response(url, status, html)
+        self.server.count_request()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/cbor")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CacheServer(ThreadingHTTPServer):
+    ''' Local stand-in for the spacetime cache server, serving a
+    SyntheticWeb over the same keep-alive HTTP protocol. '''
+
+    daemon_threads = True
+
+    def __init__(self, web, host="127.0.0.1", port=0):
+        super().__init__((host, port), CacheRequestHandler)
+        self.web = web
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    @property
+    def address(self):
+        return self.server_address[:2]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _serve(web, connection, stop_event):
+    server = CacheServer(web).start()
+    connection.send(server.address)
+    stop_event.wait()
+    server.stop()
+    connection.send(server.requests)
+
+
+class CacheServerProcess(object):
+    ''' CacheServer run in a process of its own, so generating and
+    encoding pages neither competes for the crawler's GIL nor counts in
+    its memory. Same start/stop/address/requests as CacheServer. '''
+
+    def __init__(self, web):
+        context = multiprocessing.get_context("spawn")
+        self.connection, child_connection = context.Pipe()
+        self.stop_event = context.Event()
+        self.process = context.Process(
+            target=_serve, args=(web, child_connection, self.stop_event),
+            name="CacheServer", daemon=True)
+        self.address = None
+        self.requests = 0
+
+    def start(self):
+        self.process.start()
+        self.address = self.connection.recv()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.requests = self.connection.recv()
+        self.process.join()
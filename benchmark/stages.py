@@ -0,0 +1,65 @@
+import functools
+import inspect
+import threading
+import time
+from collections import defaultdict
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class StageTimer(object):
+    ''' Times the crawl stages by wrapping the functions the workers call,
+    for the duration of a benchmark run. '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(list)
+        self.patched = list()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.durations[stage].append(seconds)
+
+    def wrap(self, owner, name, stage):
+        function = getattr(owner, name)
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+        else:
+            @functools.wraps(function)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+        # Bound methods are wrapped on their instance, so restoring means
+        # removing the instance attribute again.
+        on_instance = inspect.ismethod(function)
+        self.patched.append((owner, name, None if on_instance else function))
+        setattr(owner, name, timed)
+
+    def restore(self):
+        for owner, name, function in reversed(self.patched):
+            if function is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, function)
+        self.patched.clear()
+
+    def summary(self):
+        ''' {stage: (count, p50, p99)} with latencies in seconds. '''
+        with self.lock:
+            return {
+                stage: (len(values), percentile(values, 0.5), percentile(values, 0.99))
+                for stage, values in self.durations.items()}
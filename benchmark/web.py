@@ -0,0 +1,110 @@
+import random
+from datetime import date, timedelta
+from urllib.parse import urlsplit, parse_qsl
+
+HOSTS = [
+    "www.ics.uci.edu", "www.cs.uci.edu",
+    "www.informatics.uci.edu", "www.stat.uci.edu"]
+
+SYLLABLES = (
+    "ba be bi bo bu ca ce ci co cu da de di do du fa fe fi fo fu ga ge gi "
+    "go gu la le li lo lu ma me mi mo mu na ne ni no nu pa pe pi po pu ra "
+    "re ri ro ru sa se si so su ta te ti to tu va ve vi vo vu").split()
+# Pronounceable made-up words, enough that pages drawn from them do not
+# look alike to SimHash.
+WORDS = [
+    a + b + c for a in SYLLABLES[:20] for b in SYLLABLES for c in SYLLABLES[:5]]
+
+CALENDAR_START = date(2020, 1, 1)
+
+
+class SyntheticWeb(object):
+    ''' Deterministic site graph spread over the allowed hosts, generated
+    from the url on demand so it takes no memory.
+
+    Regular pages live at /page/<n> for n < pages. A share of them are
+    exact duplicates of another page, oversized, or slow to serve, and
+    every host has an endless /calendar trap whose days link to the next
+    day and look alike. Other urls are 404s. '''
+
+    def __init__(
+            self, pages=2000, links=8, seed=0, duplicate_rate=0.05,
+            large_rate=0.01, large_kb=2048, slow_rate=0.02, slow_delay=0.2,
+            trap_rate=0.1, words=300):
+        self.pages = pages
+        self.links = links
+        self.seed = seed
+        self.duplicate_rate = duplicate_rate
+        self.large_rate = large_rate
+        self.large_kb = large_kb
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.trap_rate = trap_rate
+        self.words = words
+
+    @property
+    def seed_urls(self):
+        return [f"https://{host}/page/{i}" for i, host in enumerate(HOSTS)]
+
+    def _random(self, *key):
+        return random.Random(f"{self.seed}:{key}")
+
+    def page_url(self, number):
+        return f"https://{HOSTS[number % len(HOSTS)]}/page/{number}"
+
+    def _text(self, rnd, count):
+        return " ".join(rnd.choice(WORDS) for _ in range(count))
+
+    def page(self, url):
+        ''' Returns (status, html, delay) for a url. '''
+        parts = urlsplit(url)
+        segments = parts.path.strip("/").split("/")
+        if parts.netloc not in HOSTS:
+            return 404, "", 0
+        if segments[0] == "page" and len(segments) == 2 and segments[1].isdigit():
+            number = int(segments[1])
+            if number < self.pages:
+                return self._regular_page(number)
+        if segments[0] == "calendar":
+            return self._calendar_page(parts)
+        return 404, "", 0
+
+    def _regular_page(self, number):
+        rnd = self._random("page", number)
+        content_number = number
+        if rnd.random() < self.duplicate_rate:
+            content_number = rnd.randrange(self.pages)
+        content = self._random("content", content_number)
+        count = self.words
+        if rnd.random() < self.large_rate:
+            count = self.large_kb * 1024 // 8
+        paragraphs = [
+            f"<p>{self._text(content, 50)}</p>" for _ in range(max(1, count // 50))]
+        links = [
+            f'<a href="{self.page_url(rnd.randrange(self.pages))}">next</a>'
+            for _ in range(self.links)]
+        if rnd.random() < self.trap_rate:
+            day = CALENDAR_START + timedelta(days=rnd.randrange(365))
+            links.append(f'<a href="/calendar/{day.isoformat()}?view=day">events</a>')
+        delay = self.slow_delay if rnd.random() < self.slow_rate else 0
+        html = (
+            f"<html><head><title>Page {number}</title></head><body>"
+            f"{''.join(paragraphs)}{''.join(links)}</body></html>")
+        return 200, html, delay
+
+    def _calendar_page(self, parts):
+        try:
+            day = date.fromisoformat(parts.path.rstrip("/").split("/")[-1])
+        except ValueError:
+            return 404, "", 0
+        view = dict(parse_qsl(parts.query)).get("view", "day")
+        # The same boilerplate every day, so the pages only differ a little.
+        boilerplate = self._text(self._random("calendar", parts.netloc), self.words)
+        following = day + timedelta(days=1)
+        html = (
+            f"<html><body><h1>Events on {day.isoformat()}</h1>"
+            f"<p>{boilerplate}</p><p>No events.</p>"
+            f'<a href="/calendar/{following.isoformat()}?view={view}">next day</a>'
+            f'<a href="/calendar/{day.isoformat()}?view=week">week</a>'
+            f"</body></html>")
+        return 200, html, 0
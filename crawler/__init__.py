@@ -1,37 +1,96 @@
-from threading import Event
+import signal
+from threading import Event, Thread
 from utils import get_logger
 from crawler.frontier import Frontier
 from crawler.worker import Worker
+from crawler.async_worker import AsyncWorker
+from crawler.parse_pool import parse_pool
 from analysis import analyzer
+from traps import trap_detector
+from utils.download import get_download_stats
+from utils.metrics import metrics
 
 class Crawler(object):
     def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker):
         self.config = config
         self.logger = get_logger("CRAWLER")
+        # Started before anything else so the parser processes fork from a
+        # single-threaded parent: a sharded frontier starts a thread.
+        parse_pool.start(config.parse_processes)
         self.frontier = frontier_factory(config, restart)
         self.workers = list()
+        if worker_factory is Worker and config.engine == "asyncio":
+            worker_factory = AsyncWorker
         self.worker_factory = worker_factory
         self.stop_event = Event()
+        self.report_file = "crawler_report.txt"
+        self.report_requested = Event()
+        self.reporter = None
 
         if restart:
             analyzer.reset()
+        analyzer.configure(config, restart)
+        # Optional for custom frontiers, see the README.
+        if hasattr(self.frontier, "hold_completions"):
+            self.frontier.hold_completions()
+            analyzer.frontier = self.frontier
+        trap_detector.configure(config, restart)
+        analyzer.start_checkpoints()
+        metrics.start(config)
 
     def start_async(self):
+        # One asyncio worker drives all concurrent fetches on its event loop.
+        worker_count = (
+            1 if self.worker_factory is AsyncWorker
+            else self.config.threads_count)
         self.workers = [
             self.worker_factory(worker_id, self.config, self.frontier, self.stop_event)
-            for worker_id in range(self.config.threads_count)]
+            for worker_id in range(worker_count)]
         for worker in self.workers:
             worker.start()
 
     def start(self):
+        if hasattr(signal, "SIGUSR1"):
+            # `kill -USR1 <pid>` writes the report of the crawl so far. The
+            # handler only wakes the reporter thread: the main thread may be
+            # holding analyzer locks when the signal arrives.
+            self.reporter = Thread(target=self._serve_reports, daemon=True)
+            self.reporter.start()
+            signal.signal(
+                signal.SIGUSR1,
+                lambda signum, frame: self.report_requested.set())
         self.start_async()
         self.join()
 
+    def _serve_reports(self):
+        while True:
+            self.report_requested.wait()
+            self.report_requested.clear()
+            if self.stop_event.is_set():
+                return
+            analyzer.generate_report(self.report_file)
+
+    def _stop_reporter(self):
+        if self.reporter is not None:
+            self.stop_event.set()
+            self.report_requested.set()
+            self.reporter.join()
+            self.reporter = None
+
     def join(self):
         # Wait for all workers to finish
         for worker in self.workers:
             worker.join()
+        parse_pool.close()
+        self.logger.info(f"Download stats: {get_download_stats()}")
         
+        self._stop_reporter()
         # Generate report once after all workers are done
         self.logger.info("All workers finished. Generating final report...")
-        analyzer.generate_report()
+        analyzer.generate_report(self.report_file)
+        # The last checkpoint commits the last completed urls, so the
+        # frontier is closed after it.
+        analyzer.close()
+        self.frontier.close()
+        trap_detector.save()
+        metrics.stop()
@@ -0,0 +1,73 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from crawler.worker import Worker
+from utils.async_download import CacheClient, async_download
+from utils.metrics import metrics
+from traps import trap_detector
+
+
+class AsyncWorker(Worker):
+    ''' Runs many concurrent fetches on one event loop thread.
+
+    Downloads share a few keep-alive connections to the cache server, while
+    scraping and frontier updates run in a thread pool so they never block
+    the loop. Politeness is still enforced by the frontier. '''
+
+    # Seconds between frontier polls while waiting for pages in flight to
+    # discover urls.
+    IDLE_POLL = 0.1
+
+    def run(self):
+        asyncio.run(self._crawl())
+
+    async def _crawl(self):
+        host, port = self.config.cache_server
+        self.client = CacheClient(
+            host, port, self.config.async_connections,
+            self.config.connect_timeout, self.config.read_timeout)
+        self.executor = ThreadPoolExecutor(self.config.threads_count)
+        try:
+            await asyncio.gather(*[
+                self._fetch_loop() for _ in range(self.config.async_tasks)])
+            self.logger.info("Frontier is empty. Worker stopping.")
+        finally:
+            self.client.close()
+            self.executor.shutdown()
+
+    async def _next_url(self):
+        while not self.stop_event.is_set():
+            url, wait = self.frontier.poll_tbd_url(self.IDLE_POLL)
+            if url is not None or wait is None:
+                return url
+            await asyncio.sleep(wait)
+        return None
+
+    async def _fetch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            tbd_url = await self._next_url()
+            if not tbd_url:
+                break
+            start = time.perf_counter()
+            try:
+                if trap_detector.is_blocked(tbd_url):
+                    self.logger.info(f"Skipping {tbd_url}, its url template is blocked.")
+                    metrics.inc("pages_skipped")
+                    continue
+                with metrics.time("download"):
+                    resp = await async_download(
+                        tbd_url, self.config, self.client, self.logger)
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+                await loop.run_in_executor(
+                    self.executor, self.process, tbd_url, resp)
+            except Exception as e:
+                self.logger.error(f"Failed to process {tbd_url}: {e!r}")
+                metrics.inc("pages_failed")
+            finally:
+                with metrics.time("frontier_complete"):
+                    self.frontier.mark_url_complete(tbd_url)
+                metrics.observe("page", time.perf_counter() - start)
@@ -1,20 +1,63 @@
 import os
-import shelve
 import threading
+import time
 
+from collections import defaultdict
+from heapq import heappush, heappop
+from itertools import chain, count
 from threading import Thread, RLock
 from queue import Queue, Empty
 
-from utils import get_logger, get_urlhash, normalize
+from utils import get_logger, hash64
+from utils.canonical import canonicalize, site_of
+from utils.metrics import metrics
+from utils.bloom import ScalableBloomFilter
 from scraper import is_valid
+from traps import trap_detector
+from crawler.store import open_store, delete_store
+from crawler.scoring import get_scorer
+from crawler.recrawl import RecrawlSchedule, is_unchanged
 
 class Frontier(object):
     def __init__(self, config, restart):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list()
         self.frontier_lock = threading.RLock()
-        
+        self.frontier_ready = threading.Condition(self.frontier_lock)
+        # The frontier lock, recording how long workers wait for it.
+        self.locked = metrics.timed_lock(self.frontier_lock, "frontier_lock_wait")
+
+        # Per-host politeness scheduling: one queue per host and a heap of
+        # (next allowed request time, host) for hosts with queued urls.
+        # Hosts whose time has come move to a heap ordered by the score of
+        # their best url, so the best url that may be requested goes first.
+        self.scorer = get_scorer(self.config.scorer)
+        self.domain_queues = defaultdict(list)
+        self.domain_heap = list()
+        self.domain_next_allowed = dict()
+        self.ready_heap = list()
+        self.ready_scores = dict()
+        self.sequence = count()
+        self.queued_count = 0
+        # Depth of the urls in flight, for the depth of their outlinks.
+        self.url_depths = dict()
+        # Urls handed out but not yet marked complete. The crawl is over
+        # only when nothing is queued and nothing is in flight.
+        self.in_flight = 0
+        # Completed urls and page versions kept out of the store until they
+        # are committed, see hold_completions.
+        self.holding = False
+        self.held_completions = list()
+        self.held_versions = dict()
+        self.resume_chunks = iter(())
+        self.schedule = RecrawlSchedule(
+            config.recrawl_interval, config.recrawl_min_interval,
+            config.recrawl_max_interval)
+        metrics.gauge("frontier_queued", lambda: self.queued_count)
+        metrics.gauge("frontier_in_flight", lambda: self.in_flight)
+        metrics.gauge("frontier_hosts", lambda: len(self.domain_queues))
+
+        start_time = time.time()
         if not os.path.exists(self.config.save_file) and not restart:
             # Save file does not exist, but request to load save.
             self.logger.info(
@@ -24,54 +67,306 @@ class Frontier(object):
             # Save file does exists, but request to start from seed.
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
-            os.remove(self.config.save_file)
+        if restart:
+            # Some dbm backends add a suffix to the shelve file name, so
+            # delete whatever the store left behind.
+            delete_store(self.config)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
+        self.save = open_store(self.config)
+        self._open_seen_filter(restart)
         if restart:
-            for url in self.config.seed_urls:
-                self.add_url(url)
+            self.add_urls(self.config.seed_urls)
         else:
             # Set the frontier state with contents of save file.
             self._parse_save_file()
-            if not self.save:
-                for url in self.config.seed_urls:
-                    self.add_url(url)
+            if not len(self.save):
+                self.add_urls(self.config.seed_urls)
+        self.logger.info(
+            f"Frontier ready in {time.time() - start_time:.3f}s "
+            f"with {self.queued_count} urls queued.")
+
+    def _open_seen_filter(self, restart):
+        ''' Compact filter of every url hash in the store. Only a hit needs
+        a store lookup to rule out a false positive. '''
+        self.seen = ScalableBloomFilter.open(
+            self.config.save_file + ".bloom", self.config.bloom_capacity,
+            self.config.bloom_error_rate, restart)
+        store_position = len(self.save)
+        if self.seen.marker != store_position:
+            # Filter was saved before the last urls were added (or never).
+            for urlhash in self.save.hashes_since(self.seen.marker):
+                self.seen.add(hash64(urlhash))
+            self.seen.marker = store_position
+        self.seen_saved = time.time()
+
+    def _save_seen_filter(self):
+        # Called with the frontier lock held. The store is committed first,
+        # so the marker never counts rows a crash could still lose.
+        self.save.flush()
+        self.seen.marker = len(self.save)
+        self.seen.save(self.config.save_file + ".bloom")
+        self.seen_saved = time.time()
 
     def _parse_save_file(self):
-        ''' This function can be overridden for alternate saving techniques. '''
+        ''' This function can be overridden for alternate saving techniques.
+        Only the first chunk of pending urls is loaded here, the rest is
+        loaded lazily by get_tbd_url as the queues drain. '''
         with self.frontier_lock:
-            total_count = len(self.save)
-            tbd_count = 0
-            for url, completed in self.save.values():
-                if not completed and is_valid(url):
-                    self.to_be_downloaded.append(url)
-                    tbd_count += 1
+            self.resume_chunks = self.save.iter_pending(
+                self.config.resume_chunk)
+            if self.config.recrawl:
+                self.logger.info(
+                    "Recrawl: pages due for a revisit are queued after "
+                    "the pending urls.")
+                self.resume_chunks = chain(
+                    self.resume_chunks, self._due_chunks())
+            tbd_count = self._load_pending_chunk()
             self.logger.info(
-                f"Found {tbd_count} urls to be downloaded from {total_count} "
-                f"total urls discovered.")
+                f"Loaded {tbd_count} urls to be downloaded from "
+                f"{len(self.save)} total urls discovered.")
+
+    def _due_chunks(self):
+        now = time.time()
+        for chunk in self.save.iter_due(now, self.config.resume_chunk):
+            yield [
+                (url, depth, self.scorer.score(url, depth))
+                for url, depth in chunk]
+
+    def _load_pending_chunk(self):
+        start_time = time.time()
+        tbd_count = 0
+        # Skip chunks without a single valid url, so an empty queue after
+        # loading really means the pending index is exhausted.
+        while not tbd_count:
+            chunk = next(self.resume_chunks, None)
+            if chunk is None:
+                return 0
+            for url, depth, score in chunk:
+                if is_valid(url):
+                    self._enqueue(url, depth, score)
+                    tbd_count += 1
+        self.logger.info(
+            f"Loaded chunk of {tbd_count} pending urls "
+            f"in {time.time() - start_time:.3f}s.")
+        return tbd_count
+
+    def _enqueue(self, url, depth, score):
+        # www.host and host share one queue and one politeness delay.
+        host = site_of(url)
+        queue = self.domain_queues[host]
+        if not queue:
+            # Host was idle, schedule it for its next allowed request time.
+            heappush(
+                self.domain_heap,
+                (self.domain_next_allowed.get(host, 0), host))
+            self.frontier_ready.notify()
+        elif host in self.ready_scores and score < queue[0][0]:
+            # Host is already waiting for a worker; rank it by its new best.
+            self._push_ready(host, score)
+        heappush(queue, (score, next(self.sequence), url, depth))
+        self.queued_count += 1
+
+    def _push_ready(self, host, score):
+        self.ready_scores[host] = score
+        heappush(self.ready_heap, (score, next(self.sequence), host))
+
+    def _pop_ready_host(self, now):
+        # Hosts whose politeness delay has passed compete on their best url.
+        while self.domain_heap and self.domain_heap[0][0] <= now:
+            _, host = heappop(self.domain_heap)
+            self._push_ready(host, self.domain_queues[host][0][0])
+        while self.ready_heap:
+            score, _, host = heappop(self.ready_heap)
+            # Entries superseded by a better url for the host are skipped.
+            if self.ready_scores.get(host) == score:
+                del self.ready_scores[host]
+                return host
+        return None
+
+    def _pop_ready_url(self):
+        ''' Returns (url, 0) if some host may be requested right now, or
+        (None, wait) with the seconds until the earliest host is ready.
+        (None, None) means there is nothing queued at all. '''
+        if self.queued_count < self.config.resume_chunk // 2:
+            # Keep the in-memory queues topped up from the pending index.
+            self._load_pending_chunk()
+        if not self.queued_count:
+            return None, None
+        now = time.time()
+        host = self._pop_ready_host(now)
+        if host is None:
+            return None, self.domain_heap[0][0] - now
+        queue = self.domain_queues[host]
+        _, _, url, depth = heappop(queue)
+        self.queued_count -= 1
+        self.url_depths[url] = depth
+        self.scorer.fetched(url)
+        next_allowed = now + self.config.time_delay
+        self.domain_next_allowed[host] = next_allowed
+        if queue:
+            heappush(self.domain_heap, (next_allowed, host))
+            # Let a worker that is waiting without a deadline pick up the
+            # host's next ready time.
+            self.frontier_ready.notify()
+        else:
+            del self.domain_queues[host]
+        self.in_flight += 1
+        return url, 0
+
+    def is_finished(self):
+        return not self.queued_count and not self.in_flight
+
+    def poll_tbd_url(self, idle_wait=0.1):
+        ''' Non-blocking get_tbd_url for event-loop callers. Returns
+        (url, 0), or (None, wait) with the seconds to wait before polling
+        again, or (None, None) once the crawl is finished. '''
+        with self.locked:
+            url, wait = self._pop_ready_url()
+            if url is None and wait is None and not self.is_finished():
+                # Pages in flight may still add urls.
+                wait = idle_wait
+            return url, wait
 
     def get_tbd_url(self):
-        with self.frontier_lock:
-            try:
-                return self.to_be_downloaded.pop()
-            except IndexError:
-                return None
+        ''' Blocks until a url can be downloaded without breaking
+        politeness. Returns None only once the crawl is finished: nothing is
+        queued and no handed out url is still being processed. '''
+        with self.locked:
+            while True:
+                url, wait = self._pop_ready_url()
+                if url is not None:
+                    return url
+                if wait is None and self.is_finished():
+                    self.frontier_ready.notify_all()
+                    return None
+                # Only this worker waits; others can still take other hosts.
+                # Without a deadline it waits for new urls or the last
+                # in-flight page to complete.
+                self.frontier_ready.wait(wait)
 
     def add_url(self, url):
-        with self.frontier_lock:
-            url = normalize(url)
-            urlhash = get_urlhash(url)
-            if urlhash not in self.save:
-                self.save[urlhash] = (url, False)
-                self.save.sync()
-                self.to_be_downloaded.append(url)
+        self.add_urls([url])
+
+    def add_urls(self, urls, parent=None):
+        ''' Adds all outlinks of a page under one lock and one store write.
+        parent is the url the links were found on; urls without one are
+        seeds at depth 0. '''
+        with self.locked:
+            self._add_urls(urls, self.url_depths.get(parent, -1) + 1)
+
+    def _add_urls(self, urls, depth):
+        # Called with the frontier lock held.
+        new_entries = dict()
+        for url in urls:
+            url, _, urlhash, key = canonicalize(url)
+            if urlhash in new_entries:
+                continue
+            if key in self.seen and urlhash in self.save:
+                continue
+            if not trap_detector.allow(url):
+                continue
+            self.seen.add(key)
+            new_entries[urlhash] = (
+                urlhash, url, depth, self.scorer.score(url, depth))
+        if new_entries:
+            entries = list(new_entries.values())
+            self.save.add_many(entries)
+            for _, url, depth, score in entries:
+                self._enqueue(url, depth, score)
+            if (self.config.checkpoint_interval > 0
+                    and time.time() - self.seen_saved
+                    >= self.config.checkpoint_interval):
+                # Saved on the analyzer's schedule too, so resuming after a
+                # crash only replays the urls added since.
+                self._save_seen_filter()
     
     def mark_url_complete(self, url):
-        with self.frontier_lock:
-            urlhash = get_urlhash(url)
+        with self.locked:
+            urlhash = canonicalize(url).urlhash
             if urlhash not in self.save:
                 self.logger.error(
                     f"Completed url {url}, but have not seen it before.")
 
-            self.save[urlhash] = (url, True)
-            self.save.sync()
+            if self.holding:
+                self.held_completions.append((urlhash, url))
+            else:
+                self.save.mark_complete(urlhash, url)
+            self.url_depths.pop(url, None)
+            self.in_flight = max(0, self.in_flight - 1)
+            if self.is_finished():
+                self.frontier_ready.notify_all()
+
+    def hold_completions(self):
+        ''' Keeps completed urls and the versions of their pages out of the
+        store until commit_completions, so after a crash they are still
+        pending and fetched again. The crawler commits them with each
+        analyzer checkpoint, so the store never counts a page that the
+        saved statistics do not. '''
+        with self.locked:
+            self.holding = True
+
+    def take_completions(self):
+        ''' Takes what was completed since the last call, to be committed
+        once the pages are saved elsewhere. '''
+        with self.locked:
+            held = self.held_completions, self.held_versions
+            self.held_completions = list()
+            self.held_versions = dict()
+            return held
+
+    def commit_completions(self, held):
+        with self.locked:
+            self._commit_completions(held)
+
+    def _commit_completions(self, held):
+        completions, versions = held
+        for urlhash, url in completions:
+            self.save.mark_complete(urlhash, url)
+        for urlhash, version in versions.items():
+            self.save.put_version(urlhash, *version)
+        self.save.flush()
+
+    def _get_version(self, urlhash):
+        held = self.held_versions.get(urlhash)
+        if held is not None:
+            _, _, version, interval, _ = held
+            return version, interval
+        return self.save.get_version(urlhash)
+
+    def page_changed(self, url, version):
+        ''' Whether a page differs from its last fetch, None if it was
+        never fetched before. '''
+        with self.locked:
+            previous = self._get_version(canonicalize(url).urlhash)
+        if previous is None:
+            return None
+        return not is_unchanged(previous[0], version)
+
+    def record_version(self, url, version):
+        ''' Saves the version of a page just processed and schedules its
+        next visit. '''
+        with self.locked:
+            urlhash = canonicalize(url).urlhash
+            # Outside a recrawl pages are fetched once, so there is no
+            # previous version to adapt the interval from.
+            previous = (
+                self._get_version(urlhash) if self.config.recrawl else None)
+            if previous is None:
+                interval = self.schedule.initial
+            else:
+                old_version, old_interval = previous
+                interval = self.schedule.next_interval(
+                    old_interval, not is_unchanged(old_version, version))
+            version = (
+                url, self.url_depths.get(url, 0), version,
+                interval, time.time() + interval)
+            if self.holding:
+                self.held_versions[urlhash] = version
+            else:
+                self.save.put_version(urlhash, *version)
+
+    def close(self):
+        with self.frontier_lock:
+            self._commit_completions(self.take_completions())
+            self._save_seen_filter()
+            self.save.close()
@@ -0,0 +1,37 @@
+import multiprocessing
+
+from utils import get_logger
+from utils.parsing import has_body, parse_bytes, parse_response
+
+
+class ParsePool(object):
+    ''' Optional pool of parser processes, so parsing is not bound by the
+    GIL of the crawler process. Page bytes go to a parser process and only
+    the compact ParsedPage (links, word count, token counts) comes back.
+    Without started processes pages are parsed in the calling thread. '''
+
+    def __init__(self):
+        self.pool = None
+
+    def start(self, processes):
+        if processes > 0 and self.pool is None:
+            get_logger("CRAWLER").info(
+                f"Starting {processes} parser processes.")
+            self.pool = multiprocessing.Pool(processes)
+
+    def parse(self, resp):
+        if self.pool is None:
+            return parse_response(resp)
+        if not has_body(resp):
+            return None
+        # apply() blocks only this worker; the GIL is released while waiting.
+        return self.pool.apply(
+            parse_bytes, (resp.content, resp.url, resp.encoding))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+parse_pool = ParsePool()
@@ -0,0 +1,40 @@
+from collections import namedtuple
+from hashlib import blake2b
+
+# What one fetch of a page returned: a fingerprint of its body and its HTTP
+# validators ("" when the server sent none).
+PageVersion = namedtuple("PageVersion", ["fingerprint", "etag", "last_modified"])
+
+
+def page_version(resp):
+    return PageVersion(
+        blake2b(resp.body, digest_size=8).hexdigest(),
+        resp.etag, resp.last_modified)
+
+
+def is_unchanged(old, new):
+    ''' Whether new is the same page as old. The cache server fetches on
+    our behalf, so conditional requests cannot be sent; validators are
+    compared after the fetch instead. A matching validator also covers
+    bodies that only differ in per-request bits like tokens or clocks. '''
+    if new.fingerprint == old.fingerprint:
+        return True
+    if new.etag:
+        return new.etag == old.etag
+    return bool(new.last_modified) and new.last_modified == old.last_modified
+
+
+class RecrawlSchedule(object):
+    ''' Adaptive revisit intervals: a page starts at `initial` seconds, the
+    interval halves every time the page is found changed and doubles every
+    time it is not, within [minimum, maximum]. Pages that change often are
+    revisited often, static pages rarely. '''
+
+    def __init__(self, initial, minimum, maximum):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def next_interval(self, interval, changed):
+        interval = interval / 2 if changed else interval * 2
+        return min(max(interval, self.minimum), self.maximum)
@@ -0,0 +1,65 @@
+import math
+from collections import Counter
+from importlib import import_module
+from urllib.parse import urlparse, parse_qsl
+
+from utils.canonical import canonicalize
+from traps import url_template
+
+class Scorer(object):
+    ''' Orders the frontier: urls with a lower score are downloaded first
+    (ties in discovery order). score() is called once, when a url is
+    discovered; fetched() whenever a url is handed out. '''
+
+    def score(self, url, depth):
+        return 0.0
+
+    def fetched(self, url):
+        pass
+
+
+class BreadthFirstScorer(Scorer):
+    def score(self, url, depth):
+        return float(depth)
+
+
+class BestFirstScorer(Scorer):
+    ''' Prefers shallow urls, hosts that have been covered the least, url
+    patterns that have not been seen often, and few query parameters. '''
+
+    DEPTH_WEIGHT = 1.0
+    HOST_WEIGHT = 0.5
+    PATTERN_WEIGHT = 1.0
+    QUERY_WEIGHT = 0.5
+
+    def __init__(self):
+        self.host_fetched = Counter()
+        self.pattern_seen = Counter()
+
+    def score(self, url, depth):
+        pattern = url_template(url)
+        self.pattern_seen[pattern] += 1
+        query_count = len(parse_qsl(urlparse(url).query, keep_blank_values=True))
+        return (
+            self.DEPTH_WEIGHT * depth
+            + self.HOST_WEIGHT * math.log1p(self.host_fetched[canonicalize(url).host])
+            + self.PATTERN_WEIGHT * math.log1p(self.pattern_seen[pattern] - 1)
+            + self.QUERY_WEIGHT * query_count)
+
+    def fetched(self, url):
+        self.host_fetched[canonicalize(url).host] += 1
+
+
+SCORERS = {
+    "fifo": Scorer,
+    "breadth_first": BreadthFirstScorer,
+    "best_first": BestFirstScorer,
+}
+
+
+def get_scorer(name):
+    ''' A name from SCORERS, or a dotted path to a Scorer class. '''
+    if name in SCORERS:
+        return SCORERS[name]()
+    module_name, _, class_name = name.rpartition(".")
+    return getattr(import_module(module_name), class_name)()
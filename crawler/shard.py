@@ -0,0 +1,193 @@
+import copy
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from collections import defaultdict
+from queue import Empty
+
+from utils import get_logger
+from utils.canonical import site_of
+from crawler.frontier import Frontier
+
+# Seconds between checks of the inbox, the idle state and termination.
+POLL_INTERVAL = 0.1
+
+
+def shard_of(url, shards):
+    ''' Shard owning the url's host. crc32 is stable across processes,
+    unlike hash(). "www." is ignored, like in the url identity. '''
+    return zlib.crc32(site_of(url).encode("utf-8")) % shards
+
+
+def shard_path(path, shard):
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}{ext}"
+
+
+def shard_config(config, shard):
+    ''' Copy of config with the files of one shard. '''
+    config = copy.copy(config)
+    config.save_file = shard_path(config.save_file, shard)
+    config.content_dir = os.path.join(config.content_dir, f"shard{shard}")
+    if config.index_dir:
+        config.index_dir = os.path.join(config.index_dir, f"shard{shard}")
+    if config.metrics_file:
+        config.metrics_file = shard_path(config.metrics_file, shard)
+    if config.metrics_port > 0:
+        config.metrics_port += shard
+    return config
+
+
+class ShardExchange(object):
+    ''' What the shard processes share: one inbox queue per shard for
+    forwarded urls, and the counters used to detect the end of the crawl.
+
+    idle[i] is 1 while shard i has nothing queued or in flight. sent[i]
+    and received[i] count the batches shard i forwarded and took in. The
+    crawl is over when every shard is idle and every sent batch has been
+    received, twice in a row without any counter moving. '''
+
+    def __init__(self, shards, context):
+        self.shards = shards
+        self.inboxes = [context.Queue() for _ in range(shards)]
+        self.idle = context.RawArray("q", shards)
+        self.sent = context.RawArray("q", shards)
+        self.received = context.RawArray("q", shards)
+        self.done = context.Event()
+
+    def snapshot(self):
+        # Idle flags are read before the counters, see ShardedFrontier.
+        idle = all(self.idle)
+        return idle, sum(self.sent), sum(self.received)
+
+    def watch(self, processes):
+        ''' Runs in the parent until every shard process has exited. '''
+        previous = None
+        while any(process.is_alive() for process in processes):
+            if any(process.exitcode for process in processes):
+                # A shard died: let the others finish what they have queued.
+                self.done.set()
+            current = self.snapshot()
+            idle, sent, received = current
+            if idle and sent == received and current == previous:
+                self.done.set()
+            previous = current
+            time.sleep(POLL_INTERVAL)
+
+
+class ShardedFrontier(Frontier):
+    ''' Frontier of one shard: it only queues urls of the hosts it owns,
+    so politeness per host holds across shards, and forwards other urls
+    to their shard in one batch per page and shard. '''
+
+    def __init__(self, config, restart, shard, exchange):
+        self.shard = shard
+        self.exchange = exchange
+        super().__init__(config, restart)
+        self.receiver = threading.Thread(target=self._receive, daemon=True)
+        self.receiver.start()
+
+    def owns(self, url):
+        return shard_of(url, self.exchange.shards) == self.shard
+
+    def _send(self, shard, urls, depth):
+        self.exchange.sent[self.shard] += 1
+        self.exchange.inboxes[shard].put((urls, depth))
+
+    def add_urls(self, urls, parent=None):
+        with self.locked:
+            depth = self.url_depths.get(parent, -1) + 1
+            own = list()
+            foreign = defaultdict(list)
+            for url in urls:
+                shard = shard_of(url, self.exchange.shards)
+                if shard == self.shard:
+                    own.append(url)
+                else:
+                    foreign[shard].append(url)
+            for shard, batch in foreign.items():
+                self._send(shard, batch, depth)
+            self._add_urls(own, depth)
+
+    def _enqueue(self, url, depth, score):
+        # Only urls resumed from a save file written with another number
+        # of shards can belong elsewhere.
+        if self.owns(url):
+            super()._enqueue(url, depth, score)
+        else:
+            self._send(shard_of(url, self.exchange.shards), [url], depth)
+
+    def is_finished(self):
+        return super().is_finished() and self.exchange.done.is_set()
+
+    def _receive(self):
+        inbox = self.exchange.inboxes[self.shard]
+        while True:
+            try:
+                urls, depth = inbox.get(timeout=POLL_INTERVAL)
+            except Empty:
+                urls = None
+            with self.locked:
+                if urls is not None:
+                    # Busy before the batch counts as received, so the
+                    # parent never sees it received by an idle shard.
+                    self.exchange.idle[self.shard] = 0
+                    self._add_urls(urls, depth)
+                    self.exchange.received[self.shard] += 1
+                elif Frontier.is_finished(self):
+                    self.exchange.idle[self.shard] = 1
+                if self.exchange.done.is_set():
+                    # Wake the workers waiting for urls to let them stop.
+                    self.frontier_ready.notify_all()
+                    return
+
+
+def _run_shard(config, restart, shard, exchange):
+    from crawler import Crawler
+    config = shard_config(config, shard)
+    crawler = Crawler(
+        config, restart,
+        frontier_factory=lambda config, restart: ShardedFrontier(
+            config, restart, shard, exchange))
+    crawler.report_file = shard_path(crawler.report_file, shard)
+    crawler.start()
+
+
+def run_sharded(config, restart):
+    ''' Crawls with config.shards processes, each owning the hosts that
+    hash to it, and writes one report merged from all shards. '''
+    logger = get_logger("CRAWLER")
+    context = multiprocessing.get_context("spawn")
+    exchange = ShardExchange(config.shards, context)
+    processes = [
+        context.Process(
+            target=_run_shard, args=(config, restart, shard, exchange),
+            name=f"Shard-{shard}")
+        for shard in range(config.shards)]
+    logger.info(f"Starting {config.shards} crawler shards.")
+    for process in processes:
+        process.start()
+    exchange.watch(processes)
+    for process in processes:
+        process.join()
+    logger.info("All shards finished. Generating merged report...")
+    merged_analyzer(config).generate_report()
+
+
+def merged_analyzer(config):
+    ''' Analyzer holding the saved state of every shard. '''
+    from analysis import CrawlerAnalyzer
+    from traps import TrapDetector
+    merged = CrawlerAnalyzer()
+    merged.open_state(shard_config(config, 0))
+    for shard in range(1, config.shards):
+        shard_analyzer = CrawlerAnalyzer()
+        shard_analyzer.open_state(shard_config(config, shard))
+        merged.merge_shard(shard_analyzer)
+    for shard in range(config.shards):
+        detector = TrapDetector()
+        detector.configure(shard_config(config, shard))
+        merged.shard_blocked_templates.extend(detector.get_blocked_templates())
+    return merged
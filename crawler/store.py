@@ -0,0 +1,292 @@
+import os
+import shelve
+import sqlite3
+import time
+
+from crawler.recrawl import PageVersion
+from utils.metrics import metrics
+
+
+class FrontierStore(object):
+    ''' Persistent map of urlhash -> (url, completed) used by the Frontier,
+    plus an index of pending urls with their depth and frontier score, and
+    the version of every fetched page with its next revisit time.
+
+    Writes are group-committed: they become durable once commit_size writes
+    are pending or commit_interval seconds have passed since the last
+    commit, whichever comes first. commit_size = 1 syncs on every write. '''
+
+    def __init__(self, path, commit_size=1, commit_interval=0.0):
+        self.path = path
+        self.commit_size = max(1, commit_size)
+        self.commit_interval = commit_interval
+        self.pending_writes = 0
+        self.last_commit = time.time()
+
+    def _wrote(self, count=1):
+        self.pending_writes += count
+        if (self.pending_writes >= self.commit_size
+                or time.time() - self.last_commit >= self.commit_interval):
+            self.flush()
+
+    def flush(self):
+        if self.pending_writes:
+            with metrics.time("store_commit"):
+                self._commit()
+        self.pending_writes = 0
+        self.last_commit = time.time()
+
+    def _commit(self):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+
+class ShelveStore(FrontierStore):
+    SUFFIXES = tuple(
+        name + ext for name in ("", ".pending", ".versions")
+        for ext in ("", ".db", ".dat", ".dir", ".bak"))
+
+    def __init__(self, path, commit_size=1, commit_interval=0.0):
+        super().__init__(path, commit_size, commit_interval)
+        self.save = shelve.open(path)
+        # Separate index of urls still to be downloaded, so resuming only
+        # reads the pending urls.
+        self.pending = shelve.open(path + ".pending")
+        # urlhash -> (url, depth, fingerprint, etag, last_modified,
+        # interval, due) of fetched pages.
+        self.versions = shelve.open(path + ".versions")
+
+    def __contains__(self, urlhash):
+        return urlhash in self.save
+
+    def __len__(self):
+        return len(self.save)
+
+    def values(self):
+        return self.save.values()
+
+    def hashes_since(self, position):
+        # Shelve has no insertion order, so every hash is returned.
+        return list(self.save.keys())
+
+    def iter_pending(self, chunk_size):
+        # Unordered; the frontier's heaps order each chunk.
+        hashes = list(self.pending.keys())
+        for start in range(0, len(hashes), chunk_size):
+            chunk = list()
+            for urlhash in hashes[start:start + chunk_size]:
+                entry = self.pending.get(urlhash)
+                if isinstance(entry, str):
+                    # Saved before depth and score were kept.
+                    entry = (entry, 0, 0.0)
+                if entry is not None:
+                    chunk.append(entry)
+            yield chunk
+
+    def add_many(self, entries):
+        for urlhash, url, depth, score in entries:
+            self.save[urlhash] = (url, False)
+            self.pending[urlhash] = (url, depth, score)
+        self._wrote(len(entries))
+
+    def mark_complete(self, urlhash, url):
+        self.save[urlhash] = (url, True)
+        if urlhash in self.pending:
+            del self.pending[urlhash]
+        self._wrote()
+
+    def get_version(self, urlhash):
+        entry = self.versions.get(urlhash)
+        if entry is None:
+            return None
+        return PageVersion(*entry[2:5]), entry[5]
+
+    def put_version(self, urlhash, url, depth, version, interval, due):
+        self.versions[urlhash] = (url, depth, *version, interval, due)
+        self._wrote()
+
+    def iter_due(self, now, chunk_size):
+        # Unordered, like iter_pending.
+        chunk = list()
+        for urlhash in list(self.versions.keys()):
+            entry = self.versions.get(urlhash)
+            if entry is not None and entry[6] <= now:
+                chunk.append(entry[:2])
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = list()
+        if chunk:
+            yield chunk
+
+    def _commit(self):
+        self.save.sync()
+        self.pending.sync()
+        self.versions.sync()
+
+    def close(self):
+        super().close()
+        self.save.close()
+        self.pending.close()
+        self.versions.close()
+
+
+class SQLiteStore(FrontierStore):
+    SUFFIXES = ("", "-wal", "-shm", "-journal")
+
+    def __init__(self, path, commit_size=1, commit_interval=0.0):
+        super().__init__(path, commit_size, commit_interval)
+        # All access is serialized by the frontier lock.
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS urls ("
+            "hash TEXT PRIMARY KEY, url TEXT NOT NULL, "
+            "completed INTEGER NOT NULL DEFAULT 0)")
+        # Index of urls still to be downloaded, ordered by frontier score,
+        # so resuming reads only pending rows, best first and in chunks.
+        has_pending = self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+            "AND name = 'pending'").fetchone()
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "hash TEXT NOT NULL UNIQUE, url TEXT NOT NULL, "
+            "depth INTEGER NOT NULL DEFAULT 0, "
+            "score REAL NOT NULL DEFAULT 0)")
+        if not has_pending:
+            # Save file from before the pending index existed.
+            self.db.execute(
+                "INSERT INTO pending (hash, url) "
+                "SELECT hash, url FROM urls WHERE completed = 0")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(pending)")}
+        if "score" not in columns:
+            # Pending index from before urls were scored.
+            self.db.execute(
+                "ALTER TABLE pending ADD COLUMN depth INTEGER NOT NULL DEFAULT 0")
+            self.db.execute(
+                "ALTER TABLE pending ADD COLUMN score REAL NOT NULL DEFAULT 0")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS pending_by_score ON pending (score, seq)")
+        # Version of every fetched page and when it is due for a revisit.
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS versions ("
+            "hash TEXT PRIMARY KEY, url TEXT NOT NULL, "
+            "depth INTEGER NOT NULL DEFAULT 0, fingerprint TEXT NOT NULL, "
+            "etag TEXT NOT NULL DEFAULT '', "
+            "last_modified TEXT NOT NULL DEFAULT '', "
+            "interval REAL NOT NULL, due REAL NOT NULL)")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS versions_by_due ON versions (due)")
+        self.db.commit()
+
+    def __contains__(self, urlhash):
+        return self.db.execute(
+            "SELECT 1 FROM urls WHERE hash = ?", (urlhash,)).fetchone() is not None
+
+    def __len__(self):
+        # Rows are never deleted from urls, so the largest rowid is the row
+        # count without scanning the table.
+        return self.db.execute(
+            "SELECT COALESCE(MAX(rowid), 0) FROM urls").fetchone()[0]
+
+    def values(self):
+        for url, completed in self.db.execute("SELECT url, completed FROM urls"):
+            yield url, bool(completed)
+
+    def hashes_since(self, position):
+        ''' Hashes added after the store had `position` rows. '''
+        return [urlhash for urlhash, in self.db.execute(
+            "SELECT hash FROM urls WHERE rowid > ?", (position,))]
+
+    def iter_pending(self, chunk_size):
+        ''' Chunks of (url, depth, score), best score first. Only rows
+        pending when resuming; later adds are already queued. '''
+        last_seq = self.db.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM pending").fetchone()[0]
+        position = (float("-inf"), 0)
+        while True:
+            rows = self.db.execute(
+                "SELECT score, seq, url, depth FROM pending "
+                "WHERE (score, seq) > (?, ?) AND seq <= ? "
+                "ORDER BY score, seq LIMIT ?",
+                (*position, last_seq, chunk_size)).fetchall()
+            if not rows:
+                return
+            position = rows[-1][:2]
+            yield [(url, depth, score) for score, _, url, depth in rows]
+
+    def add_many(self, entries):
+        self.db.executemany(
+            "INSERT OR IGNORE INTO urls (hash, url) VALUES (?, ?)",
+            [entry[:2] for entry in entries])
+        self.db.executemany(
+            "INSERT OR IGNORE INTO pending (hash, url, depth, score) "
+            "VALUES (?, ?, ?, ?)", entries)
+        self._wrote(len(entries))
+
+    def mark_complete(self, urlhash, url):
+        self.db.execute(
+            "INSERT INTO urls (hash, url, completed) VALUES (?, ?, 1) "
+            "ON CONFLICT(hash) DO UPDATE SET completed = 1", (urlhash, url))
+        self.db.execute("DELETE FROM pending WHERE hash = ?", (urlhash,))
+        self._wrote()
+
+    def get_version(self, urlhash):
+        ''' (PageVersion, interval) of the last fetch of a page, or None. '''
+        row = self.db.execute(
+            "SELECT fingerprint, etag, last_modified, interval FROM versions "
+            "WHERE hash = ?", (urlhash,)).fetchone()
+        if row is None:
+            return None
+        return PageVersion(*row[:3]), row[3]
+
+    def put_version(self, urlhash, url, depth, version, interval, due):
+        self.db.execute(
+            "INSERT OR REPLACE INTO versions (hash, url, depth, fingerprint, "
+            "etag, last_modified, interval, due) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (urlhash, url, depth, *version, interval, due))
+        self._wrote()
+
+    def iter_due(self, now, chunk_size):
+        ''' Chunks of (url, depth) of the pages due for a revisit at `now`,
+        longest overdue first. Revisited pages move past `now`, so none is
+        returned twice. '''
+        position = (float("-inf"), 0)
+        while True:
+            rows = self.db.execute(
+                "SELECT due, rowid, url, depth FROM versions "
+                "WHERE (due, rowid) > (?, ?) AND due <= ? "
+                "ORDER BY due, rowid LIMIT ?",
+                (*position, now, chunk_size)).fetchall()
+            if not rows:
+                return
+            position = rows[-1][:2]
+            yield [(url, depth) for _, _, url, depth in rows]
+
+    def _commit(self):
+        self.db.commit()
+
+    def close(self):
+        super().close()
+        self.db.close()
+
+
+STORES = {
+    "shelve": ShelveStore,
+    "sqlite": SQLiteStore,
+}
+
+
+def open_store(config):
+    store_class = STORES[config.store_type]
+    return store_class(
+        config.save_file, config.commit_size, config.commit_interval)
+
+
+def delete_store(config):
+    for suffix in STORES[config.store_type].SUFFIXES:
+        if os.path.exists(config.save_file + suffix):
+            os.remove(config.save_file + suffix)
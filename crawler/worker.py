@@ -3,9 +3,12 @@ from threading import Thread, Event
 from inspect import getsource
 from utils.download import download
 from utils import get_logger
+from utils.metrics import metrics
+from crawler.parse_pool import parse_pool
+from crawler.recrawl import page_version
 import scraper
+from traps import trap_detector
 import time
-from analysis import analyzer
 
 
 class Worker(Thread):
@@ -18,26 +21,64 @@ class Worker(Thread):
         assert {getsource(scraper).find(req) for req in {"from requests import", "import requests"}} == {-1}, "Do not use requests in scraper.py"
         assert {getsource(scraper).find(req) for req in {"from urllib.request import", "import urllib.request"}} == {-1}, "Do not use urllib.request in scraper.py"
         
-        # Set politeness delay from config
-        analyzer.set_politeness_delay(config.time_delay)
-        
         super().__init__(daemon=True)
         
     def run(self):
         while not self.stop_event.is_set():
-            tbd_url = self.frontier.get_tbd_url()
+            # Includes waiting for politeness and for other workers.
+            with metrics.time("frontier_get"):
+                tbd_url = self.frontier.get_tbd_url()
             if not tbd_url:
                 self.logger.info("Frontier is empty. Worker stopping.")
                 break
             
-            analyzer.check_domain_politeness(tbd_url)
-            
-            resp = download(tbd_url, self.config, self.logger)
-            
-            self.logger.info(
-                f"Downloaded {tbd_url}, status <{resp.status}>, "
-                f"using cache {self.config.cache_server}.")
-            scraped_urls = scraper.scraper(tbd_url, resp)
-            for scraped_url in scraped_urls:
-                self.frontier.add_url(scraped_url)
-            self.frontier.mark_url_complete(tbd_url)
+            start = time.perf_counter()
+            try:
+                if trap_detector.is_blocked(tbd_url):
+                    self.logger.info(f"Skipping {tbd_url}, its url template is blocked.")
+                    metrics.inc("pages_skipped")
+                    continue
+                with metrics.time("download"):
+                    resp = download(tbd_url, self.config, self.logger)
+                
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+                self.process(tbd_url, resp)
+            except Exception as e:
+                self.logger.error(f"Failed to process {tbd_url}: {e!r}")
+                metrics.inc("pages_failed")
+            finally:
+                # Always completed, or the frontier would wait on it forever.
+                with metrics.time("frontier_complete"):
+                    self.frontier.mark_url_complete(tbd_url)
+                metrics.observe("page", time.perf_counter() - start)
+
+    def process(self, tbd_url, resp):
+        ''' Parses and scrapes a downloaded page and queues its links. When
+        recrawling, a page that has not changed since its last fetch stops
+        at its fingerprint. '''
+        metrics.inc(f"status_{resp.status}")
+        version = None
+        # Versions are optional for custom frontiers, see the README.
+        if resp.has_page() and hasattr(self.frontier, "record_version"):
+            version = page_version(resp)
+        revisit = False
+        if version is not None and self.config.recrawl:
+            changed = self.frontier.page_changed(tbd_url, version)
+            if changed is False:
+                metrics.inc("pages_unchanged")
+                self.frontier.record_version(tbd_url, version)
+                return
+            if changed:
+                metrics.inc("pages_changed")
+                revisit = True
+        with metrics.time("parse"):
+            page = parse_pool.parse(resp)
+        with metrics.time("scrape"):
+            scraped_urls = scraper.scraper(tbd_url, resp, page, revisit)
+        with metrics.time("frontier_add"):
+            self.frontier.add_urls(scraped_urls, parent=tbd_url)
+        if version is not None:
+            # Only once processed, so a crash before then fetches it anew.
+            self.frontier.record_version(tbd_url, version)
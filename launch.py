@@ -1,16 +1,60 @@
+import os
 from configparser import ConfigParser
 from argparse import ArgumentParser
 
 from utils.server_registration import get_cache_server
 from utils.config import Config
 from crawler import Crawler
+from crawler.shard import run_sharded, merged_analyzer, shard_config
+from utils.inverted_index import InvertedIndex
+from analysis import analyzer
+from traps import trap_detector
 
 
-def main(config_file, restart):
+def search(config, query):
+    if not config.index_dir:
+        print("No index to search: set INDEX_DIR in the config file and crawl.")
+        return
+    # Each shard indexes its own pages.
+    configs = (
+        [shard_config(config, shard) for shard in range(config.shards)]
+        if config.shards > 1 else [config])
+    results = list()
+    for shard in configs:
+        if not os.path.exists(os.path.join(shard.index_dir, "postings.dat")):
+            # Blocks are merged into the index when a crawl finishes.
+            print(
+                f"No index in {shard.index_dir}: "
+                f"it is written when the crawl finishes.")
+            return
+        index = InvertedIndex(shard.index_dir)
+        results.extend(index.search(query))
+        index.close()
+    for url, score in sorted(results, key=lambda result: -result[1])[:10]:
+        print(f"{score:8.3f}  {url}")
+
+
+def main(config_file, restart, report, query=None, recrawl=False):
     cparser = ConfigParser()
     cparser.read(config_file)
     config = Config(cparser)
+    config.recrawl = recrawl and not restart
+    if query:
+        search(config, query)
+        return
+    if report:
+        # Report from the last checkpoint, while a crawl may be running.
+        if config.shards > 1:
+            merged_analyzer(config).generate_report()
+        else:
+            analyzer.open_state(config)
+            trap_detector.configure(config)
+            analyzer.generate_report()
+        return
     config.cache_server = get_cache_server(config, restart)
+    if config.shards > 1:
+        run_sharded(config, restart)
+        return
     crawler = Crawler(config, restart)
     crawler.start()
 
@@ -19,5 +63,8 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
     parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--report", action="store_true", default=False)
+    parser.add_argument("--search", type=str, default=None)
+    parser.add_argument("--recrawl", action="store_true", default=False)
     args = parser.parse_args()
-    main(args.config_file, args.restart)
+    main(args.config_file, args.restart, args.report, args.search, args.recrawl)
@@ -1,7 +1,9 @@
 import re
-from urllib.parse import urljoin, urlparse
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse
 from analysis import analyzer
+from traps import trap_detector
+from utils.canonical import canonicalize
+from utils.parsing import parse_response
 
 FILE_EXTENSION_PATTERN = re.compile(
     r".*\.(css|js|bmp|gif|jpe?g|ico"
@@ -19,19 +21,27 @@ ALLOWED_DOMAINS = {
     "informatics.uci.edu", "www.informatics.uci.edu", "stat.uci.edu", "www.stat.uci.edu"
 }
 
-def scraper(url, resp):
-    if analyzer.is_url_visited(url):
+def scraper(url, resp, page=None, revisit=False):
+    # revisit: the page was crawled before and has changed since.
+    if analyzer.is_url_visited(url) and not revisit:
         print(f"Skipping duplicate URL: {url}")
         return []
         
-    links = extract_next_links(url, resp)
-    
-    if resp.status == 200 and resp.raw_response and resp.raw_response.content:
-        try:
-            content = resp.raw_response.content.decode('utf-8', errors='ignore')
-            analyzer.add_page(url, content)
-        except Exception as e:
+    if page is None:
+        page = parse_response(resp)
+    if page is not None:
+        original = analyzer.find_duplicate(url, page)
+        if original is not None:
+            # Counted as a unique page, but not mined for words or links.
+            print(f"Skipping near-duplicate of {original}: {url}")
             analyzer.add_page(url)
+            trap_detector.record(url, page, duplicate=True)
+            return []
+    trap_detector.record(url, page)
+    links = extract_next_links(url, resp, page)
+    
+    if page is not None:
+        analyzer.add_page(url, page, resp.body, revisit)
     else:
         analyzer.add_page(url)
     
@@ -45,28 +55,17 @@ def scraper(url, resp):
     
     return valid_links
 
-def extract_next_links(url, resp):
-    if resp.status != 200 or not resp.raw_response or not resp.raw_response.content:
+def extract_next_links(url, resp, page=None):
+    if page is None:
+        page = parse_response(resp)
+    if page is None:
         return []
     
     try:
-        html_content = resp.raw_response.content.decode('utf-8', errors='ignore')
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
         links = []
-        for link in soup.find_all('a', href=True):
-            href = link['href']
-            
-            absolute_url = urljoin(resp.url, href)
-            
-            absolute_url = absolute_url.split('#')[0]
-            
-            if '?' in absolute_url:
-                has_real_params = '=' in absolute_url or '&' in absolute_url
-                if not has_real_params:
-                    absolute_url = absolute_url.split('?')[0]
-            
-            links.append(absolute_url)
+        for absolute_url in page.links:
+            # Same canonical form the analyzer and the frontier use.
+            links.append(canonicalize(absolute_url).url)
             
     except Exception as e:
         print(f"error in parsing links, {e}")
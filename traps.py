@@ -0,0 +1,197 @@
+import os
+import re
+import threading
+from collections import deque
+from urllib.parse import urlsplit, parse_qsl
+
+from utils import get_logger
+from utils.canonical import canonicalize
+from utils.checkpoint import read_records, rewrite_records
+from utils.simhash import hamming_distance
+
+DATE_PATTERN = re.compile(r"^\d{4}[-_/]?\d{1,2}([-_/]?\d{1,2})?$")
+ID_PATTERN = re.compile(r"^(?=.*\d)[0-9a-fA-F-]{8,}$")
+DIGITS_PATTERN = re.compile(r"\d+")
+
+OPEN, THROTTLED, BLOCKED = "open", "throttled", "blocked"
+# Budget used up: no new urls are admitted, but queued ones are fetched.
+EXHAUSTED = "exhausted"
+
+
+def url_template(url):
+    ''' Template a url belongs to: host, path with dates, ids and numbers
+    replaced, and the sorted query keys without their values. Pages of a
+    calendar, a revision history or a paginated listing share one. '''
+    canonical = canonicalize(url)
+    parts = urlsplit(canonical.url)
+    segments = list()
+    for segment in parts.path.split("/"):
+        if DATE_PATTERN.match(segment):
+            segments.append("{date}")
+        elif ID_PATTERN.match(segment):
+            segments.append("{id}")
+        else:
+            segments.append(DIGITS_PATTERN.sub("{n}", segment))
+    keys = sorted({key for key, _ in parse_qsl(parts.query, keep_blank_values=True)})
+    host = canonical.host
+    if host.startswith("www."):
+        host = host[4:]
+    return f"{host}{'/'.join(segments)}?{'&'.join(keys)}"
+
+
+class TemplateStats:
+    ''' What one url template has produced so far. novelty is a moving
+    average of whether its recent pages had new content. '''
+    def __init__(self):
+        self.admitted = 0
+        self.discovered = 0
+        self.pages = 0
+        self.novel = 0
+        self.novelty = 1.0
+        self.state = OPEN
+        self.fingerprints = deque(maxlen=TrapDetector.RECENT_FINGERPRINTS)
+
+
+class TrapDetector:
+    ''' Learns url templates as pages come in and cuts off the ones that
+    stop producing new content.
+
+    A page is novel if it is not a near-duplicate and its SimHash is not
+    close to the template's recent pages. Once a template has min_pages
+    pages, it is throttled while its novelty is below novelty_threshold
+    (only one of every THROTTLE_EVERY new links is kept) and blocked below
+    a quarter of it. No template gets more than budget urls: after that it
+    is exhausted, which drops its new links but still fetches the queued
+    ones. '''
+
+    RECENT_FINGERPRINTS = 8
+    NOVELTY_WEIGHT = 0.1
+    THROTTLE_EVERY = 10
+    # Fingerprints this close to a recent page of the template are
+    # boilerplate around little new text.
+    TEMPLATE_DISTANCE = 10
+    SAVE_EVERY = 1000
+
+    def __init__(self):
+        self.logger = get_logger("TRAPS")
+        self.lock = threading.Lock()
+        self.templates = dict()
+        self.path = None
+        self.unsaved = 0
+        self.min_pages = -1
+        self.novelty_threshold = 0.0
+        self.budget = 0
+
+    def configure(self, config, restart=False):
+        self.min_pages = config.trap_min_pages
+        self.novelty_threshold = config.trap_novelty
+        self.budget = config.trap_budget
+        self.path = config.save_file + ".traps"
+        if restart and os.path.exists(self.path):
+            os.remove(self.path)
+        self.templates = dict()
+        for record in read_records(self.path):
+            self.templates = record
+        blocked = sum(
+            1 for stats in self.templates.values() if stats.state == BLOCKED)
+        if self.templates:
+            self.logger.info(
+                f"Loaded {len(self.templates)} url templates, "
+                f"{blocked} blocked.")
+
+    @property
+    def enabled(self):
+        return self.min_pages >= 0
+
+    def _stats(self, template):
+        stats = self.templates.get(template)
+        if stats is None:
+            stats = self.templates[template] = TemplateStats()
+        return stats
+
+    def allow(self, url):
+        ''' Whether a newly discovered url should be added to the frontier. '''
+        if not self.enabled:
+            return True
+        template = url_template(url)
+        with self.lock:
+            stats = self._stats(template)
+            stats.discovered += 1
+            if stats.state in (BLOCKED, EXHAUSTED):
+                return False
+            if stats.state == THROTTLED and stats.discovered % self.THROTTLE_EVERY:
+                return False
+            if self.budget and stats.admitted >= self.budget:
+                self._set_state(template, stats, EXHAUSTED, "budget used up")
+                return False
+            stats.admitted += 1
+            return True
+
+    def is_blocked(self, url):
+        ''' Urls queued before their template was blocked are skipped. '''
+        if not self.enabled:
+            return False
+        stats = self.templates.get(url_template(url))
+        return stats is not None and stats.state == BLOCKED
+
+    def record(self, url, page, duplicate=False):
+        ''' Records a downloaded page of the url's template and updates the
+        template's state. page is None for pages without a usable body. '''
+        if not self.enabled:
+            return
+        template = url_template(url)
+        fingerprint = page.fingerprint if page is not None else None
+        with self.lock:
+            stats = self._stats(template)
+            novel = (
+                fingerprint is not None and not duplicate and all(
+                    hamming_distance(fingerprint, recent) > self.TEMPLATE_DISTANCE
+                    for recent in stats.fingerprints))
+            if fingerprint is not None:
+                stats.fingerprints.append(fingerprint)
+            stats.pages += 1
+            stats.novel += novel
+            stats.novelty += self.NOVELTY_WEIGHT * (novel - stats.novelty)
+            if stats.state != BLOCKED and stats.pages >= self.min_pages:
+                if stats.novelty < self.novelty_threshold / 4:
+                    self._set_state(template, stats, BLOCKED, "no new content")
+                elif stats.state == EXHAUSTED:
+                    # Admits nothing either way; only blocking changes it.
+                    pass
+                elif stats.novelty < self.novelty_threshold:
+                    self._set_state(template, stats, THROTTLED, "little new content")
+                else:
+                    self._set_state(template, stats, OPEN, "new content again")
+            self.unsaved += 1
+            if self.unsaved >= self.SAVE_EVERY:
+                self._save_locked()
+
+    def _set_state(self, template, stats, state, reason):
+        if stats.state == state:
+            return
+        self.logger.info(
+            f"{state.capitalize()} {template}: {reason} "
+            f"({stats.novel} of {stats.pages} pages novel, "
+            f"novelty {stats.novelty:.2f}, {stats.discovered} urls seen).")
+        stats.state = state
+
+    def _save_locked(self):
+        if self.path is not None:
+            rewrite_records(self.path, [self.templates])
+        self.unsaved = 0
+
+    def save(self):
+        with self.lock:
+            self._save_locked()
+
+    def get_blocked_templates(self):
+        ''' (template, urls discovered, state) of the templates that admit
+        no new urls: blocked, or with their budget used up. '''
+        with self.lock:
+            return sorted(
+                (template, stats.discovered, stats.state)
+                for template, stats in self.templates.items()
+                if stats.state in (BLOCKED, EXHAUSTED))
+
+
+trap_detector = TrapDetector()
@@ -1,7 +1,7 @@
 import os
 import logging
-from hashlib import sha256
-from urllib.parse import urlparse
+
+from utils.canonical import canonicalize
 
 def get_logger(name, filename=None):
     logger = logging.getLogger(name)
@@ -23,13 +23,12 @@ def get_logger(name, filename=None):
 
 
 def get_urlhash(url):
-    parsed = urlparse(url)
-    # everything other than scheme.
-    return sha256(
-        f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
-        f"{parsed.query}/{parsed.fragment}".encode("utf-8")).hexdigest()
+    # Identity of the canonical url, see utils/canonical.py.
+    return canonicalize(url).urlhash
+
+def hash64(urlhash):
+    # First 64 bits of a get_urlhash digest, used as a compact key.
+    return int(urlhash[:16], 16)
 
 def normalize(url):
-    if url.endswith("/"):
-        return url.rstrip("/")
-    return url
+    return canonicalize(url).url
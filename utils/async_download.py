@@ -0,0 +1,115 @@
+import asyncio
+from urllib.parse import urlencode
+
+from utils.download import (
+    RETRY_STATUSES, record_stat, build_response, unreachable_response)
+from utils.metrics import metrics
+
+
+class CacheClient(object):
+    ''' Minimal HTTP/1.1 client for the cache server on asyncio streams.
+
+    Any number of tasks can call get(); they share at most `size` keep-alive
+    connections and wait for a free one. '''
+
+    def __init__(self, host, port, size, connect_timeout, read_timeout):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.slots = asyncio.Semaphore(size)
+        self.idle = list()
+
+    async def get(self, query):
+        async with self.slots:
+            if self.idle:
+                connection = self.idle.pop()
+            else:
+                connection = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port),
+                    self.connect_timeout)
+            try:
+                status, body, keep_alive = await asyncio.wait_for(
+                    self._request(connection, query), self.read_timeout)
+            except BaseException:
+                connection[1].close()
+                raise
+            if keep_alive:
+                self.idle.append(connection)
+            else:
+                connection[1].close()
+            return status, body
+
+    async def _request(self, connection, query):
+        reader, writer = connection
+        writer.write(
+            f"GET /?{query} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            f"Connection: keep-alive\r\n\r\n".encode("latin-1"))
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            # Idle connection was closed by the server.
+            raise ConnectionError("Connection closed by cache server.")
+        version, status = status_line.split()[:2]
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = (
+            version == b"HTTP/1.1"
+            and headers.get("connection", "").lower() != "close")
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await self._read_chunked(reader)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return int(status), body, keep_alive
+
+    async def _read_chunked(self, reader):
+        chunks = list()
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if not size:
+                # Skip trailers up to the blank line.
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+
+    def close(self):
+        for reader, writer in self.idle:
+            writer.close()
+        self.idle.clear()
+
+
+async def async_download(url, config, client, logger=None):
+    ''' asyncio counterpart of utils.download.download, with the same
+    retry policy and stats. '''
+    query = urlencode([("q", f"{url}"), ("u", f"{config.user_agent}")])
+    error = None
+    for attempt in range(config.download_retries + 1):
+        if attempt:
+            record_stat("retries")
+            await asyncio.sleep(config.retry_backoff * 2 ** (attempt - 1))
+        record_stat("requests")
+        try:
+            with metrics.time("cache_request"):
+                status, body = await client.get(query)
+        except asyncio.TimeoutError as e:
+            record_stat("timeouts")
+            error = e
+            continue
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, ValueError) as e:
+            error = e
+            continue
+        if status in RETRY_STATUSES and attempt < config.download_retries:
+            continue
+        return build_response(url, status, body, logger, config.max_page_size)
+    return unreachable_response(url, error, logger)
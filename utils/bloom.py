@@ -0,0 +1,119 @@
+import math
+import os
+import struct
+
+# File header: stage count, initial capacity, error rate, marker.
+HEADER = struct.Struct("<IQdq")
+# Per stage: capacity, error rate, items added, length of the bit array.
+STAGE_HEADER = struct.Struct("<QdQQ")
+
+
+class BloomFilter(object):
+    ''' Fixed-capacity Bloom filter over 64-bit integer keys. '''
+
+    def __init__(self, capacity, error_rate, count=0, bits=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = count
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing from the two halves of the key.
+        low = key & 0xFFFFFFFF
+        high = (key >> 32) | 1
+        return [(low + i * high) % self.size for i in range(self.hash_count)]
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class ScalableBloomFilter(object):
+    ''' Bloom filter that adds a larger, tighter stage whenever the current
+    one is full, so the false positive rate stays below error_rate however
+    many keys are added. Keys are 64-bit integers, see utils.hash64.
+
+    marker is free for the owner to record how far the filter is in sync
+    with its backing store. '''
+
+    GROWTH = 2
+    TIGHTENING = 0.5
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.initial_capacity = capacity
+        self.error_rate = error_rate
+        self.stages = list()
+        self.marker = 0
+
+    def __len__(self):
+        return sum(stage.count for stage in self.stages)
+
+    def __contains__(self, key):
+        for stage in self.stages:
+            if key in stage:
+                return True
+        return False
+
+    def add(self, key):
+        ''' Adds key and returns True if it was not in the filter before. '''
+        if key in self:
+            return False
+        if not self.stages or self.stages[-1].count >= self.stages[-1].capacity:
+            self._add_stage()
+        self.stages[-1].add(key)
+        return True
+
+    def _add_stage(self):
+        stage_number = len(self.stages)
+        self.stages.append(BloomFilter(
+            self.initial_capacity * self.GROWTH ** stage_number,
+            self.error_rate * (1 - self.TIGHTENING)
+            * self.TIGHTENING ** stage_number))
+
+    def save(self, path):
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(HEADER.pack(
+                len(self.stages), self.initial_capacity,
+                self.error_rate, self.marker))
+            for stage in self.stages:
+                f.write(STAGE_HEADER.pack(
+                    stage.capacity, stage.error_rate,
+                    stage.count, len(stage.bits)))
+                f.write(stage.bits)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            stage_count, capacity, error_rate, marker = HEADER.unpack(
+                f.read(HEADER.size))
+            bloom = cls(capacity, error_rate)
+            bloom.marker = marker
+            for _ in range(stage_count):
+                stage_capacity, stage_error, count, length = STAGE_HEADER.unpack(
+                    f.read(STAGE_HEADER.size))
+                bloom.stages.append(BloomFilter(
+                    stage_capacity, stage_error, count,
+                    bytearray(f.read(length))))
+        return bloom
+
+    @classmethod
+    def open(cls, path, capacity, error_rate, restart=False):
+        if os.path.exists(path):
+            if not restart:
+                return cls.load(path)
+            os.remove(path)
+        return cls(capacity, error_rate)
@@ -0,0 +1,52 @@
+from collections import namedtuple
+from functools import lru_cache
+from hashlib import sha256
+from urllib.parse import urlsplit, urlunsplit
+
+# Urls seen recently enough to be canonicalized again: a page's links are
+# looked at by the scraper, the analyzer and the frontier in turn.
+CACHE_SIZE = 1 << 16
+
+DEFAULT_PORTS = {"http": ":80", "https": ":443"}
+
+# url is the canonical, fetchable form. host is its lowercase netloc, for
+# politeness and subdomain stats. urlhash identifies the page: it ignores
+# the scheme and a leading "www.", so both spellings are one page. key is
+# the first 64 bits of urlhash, for Bloom filters and in-memory indexes.
+CanonicalUrl = namedtuple("CanonicalUrl", ["url", "host", "urlhash", "key"])
+
+
+def _hashed(url, host, identity):
+    urlhash = sha256(identity.encode("utf-8")).hexdigest()
+    return CanonicalUrl(url, host, urlhash, int(urlhash[:16], 16))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def canonicalize(url):
+    ''' The one normalization of a url used by the frontier, the scraper
+    and the analyzer. Drops the fragment, a trailing slash, a default port
+    and a query without parameters; lowercases scheme and host. '''
+    url = url.strip()
+    try:
+        parsed = urlsplit(url)
+        scheme = parsed.scheme.lower()
+        host = parsed.netloc.lower()
+    except ValueError:
+        return _hashed(url, "", url)
+    if host.endswith(DEFAULT_PORTS.get(scheme, "\0")):
+        host = host.rsplit(":", 1)[0]
+    path = parsed.path.rstrip("/")
+    query = parsed.query
+    if "=" not in query and "&" not in query:
+        query = ""
+    site = host[4:] if host.startswith("www.") else host
+    return _hashed(
+        urlunsplit((scheme, host, path, query, "")), host,
+        f"{site}/{path}//{query}/")
+
+
+def site_of(url):
+    ''' The url's host without a leading "www.". Both spellings are one
+    server, so politeness and sharding go by this. '''
+    host = canonicalize(url).host
+    return host[4:] if host.startswith("www.") else host
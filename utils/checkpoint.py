@@ -0,0 +1,46 @@
+import os
+import pickle
+import struct
+import zlib
+
+# Each record: payload length, then the zlib-compressed pickle.
+RECORD_HEADER = struct.Struct("<I")
+
+
+def _encode(record):
+    payload = zlib.compress(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+    return RECORD_HEADER.pack(len(payload)) + payload
+
+
+def append_record(path, record):
+    with open(path, "ab") as f:
+        f.write(_encode(record))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def rewrite_records(path, records):
+    ''' Atomically replaces the log with `records`. '''
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        for record in records:
+            f.write(_encode(record))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def read_records(path):
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        if offset + length > len(data):
+            # Torn record from a crash while writing.
+            return
+        yield pickle.loads(zlib.decompress(data[offset:offset + length]))
+        offset += length
@@ -8,12 +8,51 @@ class Config(object):
         assert self.user_agent != "DEFAULT AGENT", "Set useragent in config.ini"
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
+        self.engine = config["LOCAL PROPERTIES"].get("ENGINE", "threads").strip().lower()
+        self.async_tasks = int(config["LOCAL PROPERTIES"].get("ASYNC_TASKS", "200"))
+        self.shards = int(config["LOCAL PROPERTIES"].get("SHARDS", "1"))
+        self.parse_processes = int(config["LOCAL PROPERTIES"].get("PARSE_PROCESSES", "0"))
+        self.async_connections = int(config["LOCAL PROPERTIES"].get("ASYNC_CONNECTIONS", "8"))
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.store_type = config["LOCAL PROPERTIES"].get("STORE", "sqlite").strip().lower()
+        self.commit_size = int(config["LOCAL PROPERTIES"].get("COMMIT_SIZE", "500"))
+        self.commit_interval = float(config["LOCAL PROPERTIES"].get("COMMIT_INTERVAL", "1.0"))
+        self.bloom_capacity = int(config["LOCAL PROPERTIES"].get("BLOOM_CAPACITY", "1000000"))
+        self.bloom_error_rate = float(config["LOCAL PROPERTIES"].get("BLOOM_ERROR_RATE", "0.001"))
+        self.near_duplicate_distance = int(config["CRAWLER"].get("NEAR_DUPLICATE_DISTANCE", "3"))
+        self.trap_min_pages = int(config["CRAWLER"].get("TRAP_MIN_PAGES", "20"))
+        self.trap_novelty = float(config["CRAWLER"].get("TRAP_NOVELTY", "0.2"))
+        self.trap_budget = int(config["CRAWLER"].get("TRAP_BUDGET", "2000"))
+        self.max_page_size = int(float(config["CRAWLER"].get("MAX_PAGE_MB", "10")) * 1024 * 1024)
+        self.scorer = config["CRAWLER"].get("SCORER", "best_first").strip()
+        self.recrawl_interval = float(config["CRAWLER"].get("RECRAWL_HOURS", "24")) * 3600
+        self.recrawl_min_interval = float(config["CRAWLER"].get("RECRAWL_MIN_HOURS", "1")) * 3600
+        self.recrawl_max_interval = float(config["CRAWLER"].get("RECRAWL_MAX_HOURS", "720")) * 3600
+        self.word_counts = config["LOCAL PROPERTIES"].get("WORD_COUNTS", "exact").strip().lower()
+        self.word_error = float(config["LOCAL PROPERTIES"].get("WORD_ERROR", "0.0001"))
+        self.checkpoint_interval = float(config["LOCAL PROPERTIES"].get("CHECKPOINT_INTERVAL", "60"))
+        self.checkpoint_compact = int(config["LOCAL PROPERTIES"].get("CHECKPOINT_COMPACT", "30"))
+        self.content_dir = config["LOCAL PROPERTIES"].get("CONTENT_DIR", "content")
+        self.content_segment_size = int(config["LOCAL PROPERTIES"].get("CONTENT_SEGMENT_MB", "64")) * 1024 * 1024
+        self.index_dir = config["LOCAL PROPERTIES"].get("INDEX_DIR", "").strip()
+        self.index_memory = int(config["LOCAL PROPERTIES"].get("INDEX_MEMORY_MB", "64")) * 1024 * 1024
+        self.resume_chunk = int(config["LOCAL PROPERTIES"].get("RESUME_CHUNK", "10000"))
+
+        self.metrics_port = int(config["LOCAL PROPERTIES"].get("METRICS_PORT", "0"))
+        self.metrics_file = config["LOCAL PROPERTIES"].get("METRICS_FILE", "metrics.txt").strip()
+        self.metrics_interval = float(config["LOCAL PROPERTIES"].get("METRICS_INTERVAL", "10"))
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
+        self.connect_timeout = float(config["CONNECTION"].get("CONNECT_TIMEOUT", "5"))
+        self.read_timeout = float(config["CONNECTION"].get("READ_TIMEOUT", "30"))
+        self.download_retries = int(config["CONNECTION"].get("RETRIES", "3"))
+        self.retry_backoff = float(config["CONNECTION"].get("RETRY_BACKOFF", "0.5"))
+        self.pool_size = int(config["CONNECTION"].get("POOL_SIZE", "2"))
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
 
-        self.cache_server = None
\ No newline at end of file
+        self.cache_server = None
+        # Set by launch.py --recrawl.
+        self.recrawl = False
\ No newline at end of file
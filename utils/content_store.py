@@ -0,0 +1,205 @@
+import os
+import mmap
+import shutil
+import struct
+import threading
+import zlib
+from hashlib import sha1
+
+# Record header in a segment file: url length, compressed body length.
+RECORD_HEADER = struct.Struct("<II")
+# Index header: slot count, used slots.
+INDEX_HEADER = struct.Struct("<QQ")
+# Index slot: url key (0 for an empty slot), segment number, record offset,
+# record length.
+INDEX_ENTRY = struct.Struct("<QIQI")
+INITIAL_SLOTS = 1 << 12
+# The index doubles once more than this share of its slots is used.
+MAX_LOAD = 0.5
+
+
+def content_key(url):
+    key = int.from_bytes(sha1(url.encode("utf-8")).digest()[:8], "little")
+    # 0 marks an empty index slot.
+    return key or 1
+
+
+class ContentStore(object):
+    ''' Append-only, zlib-compressed page store.
+
+    Pages are appended to numbered segment files and located through an
+    on-disk open-addressing hash table of fixed-size slots. Both are read
+    through mmap, so memory stays flat however many pages are stored: the
+    OS pages the index and bodies in and out as needed. '''
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, restart=False):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        if restart and os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory, exist_ok=True)
+
+        self.maps = dict()
+        self.index_path = os.path.join(directory, "index.table")
+        if not os.path.exists(self.index_path):
+            self._create_index(self.index_path, INITIAL_SLOTS)
+        self._open_index()
+        self._migrate_log(os.path.join(directory, "index.dat"))
+
+        segments = sorted(
+            int(name[8:13]) for name in os.listdir(directory)
+            if name.startswith("segment-"))
+        self.segment = segments[-1] if segments else 0
+        self.segment_file = open(self._segment_path(self.segment), "ab")
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:05d}.dat")
+
+    def _create_index(self, path, slots):
+        with open(path, "wb") as f:
+            f.write(INDEX_HEADER.pack(slots, 0))
+            f.truncate(INDEX_HEADER.size + slots * INDEX_ENTRY.size)
+
+    def _open_index(self):
+        self.index_file = open(self.index_path, "r+b")
+        self.index = mmap.mmap(self.index_file.fileno(), 0)
+        self.slots, self.used = INDEX_HEADER.unpack_from(self.index)
+
+    def _close_index(self):
+        self.index.flush()
+        self.index.close()
+        self.index_file.close()
+
+    def _migrate_log(self, path):
+        # Stores written before the hash table kept an append-only log of
+        # entries, the last one for a url winning.
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(INDEX_ENTRY.size * 4096)
+                usable = len(data) - len(data) % INDEX_ENTRY.size
+                if not usable:
+                    break
+                for entry in INDEX_ENTRY.iter_unpack(data[:usable]):
+                    self._insert(*entry)
+        self.index.flush()
+        os.remove(path)
+
+    def _find_slot(self, key):
+        # Linear probing; the table is never more than half full.
+        mask = self.slots - 1
+        slot = key & mask
+        while True:
+            position = INDEX_HEADER.size + slot * INDEX_ENTRY.size
+            slot_key, = struct.unpack_from("<Q", self.index, position)
+            if slot_key == key or not slot_key:
+                return position, slot_key
+            slot = (slot + 1) & mask
+
+    def _insert(self, key, segment, offset, length):
+        position, slot_key = self._find_slot(key)
+        INDEX_ENTRY.pack_into(self.index, position, key, segment, offset, length)
+        if not slot_key:
+            self.used += 1
+            INDEX_HEADER.pack_into(self.index, 0, self.slots, self.used)
+            if self.used > self.slots * MAX_LOAD:
+                self._grow()
+
+    def _grow(self):
+        ''' Rehashes into a table twice the size, slot by slot. '''
+        old_index, old_slots = self.index, self.slots
+        old_file = self.index_file
+        temp_path = self.index_path + ".tmp"
+        self._create_index(temp_path, old_slots * 2)
+        self.index_file = open(temp_path, "r+b")
+        self.index = mmap.mmap(self.index_file.fileno(), 0)
+        self.slots, self.used = old_slots * 2, 0
+        for slot in range(old_slots):
+            entry = INDEX_ENTRY.unpack_from(
+                old_index, INDEX_HEADER.size + slot * INDEX_ENTRY.size)
+            if entry[0]:
+                position, _ = self._find_slot(entry[0])
+                INDEX_ENTRY.pack_into(self.index, position, *entry)
+                self.used += 1
+        INDEX_HEADER.pack_into(self.index, 0, self.slots, self.used)
+        self.index.flush()
+        old_index.close()
+        old_file.close()
+        os.replace(temp_path, self.index_path)
+
+    def __len__(self):
+        return self.used
+
+    def __contains__(self, url):
+        return self._lookup(content_key(url)) is not None
+
+    def _lookup(self, key):
+        with self.lock:
+            position, slot_key = self._find_slot(key)
+            if not slot_key:
+                return None
+            return INDEX_ENTRY.unpack_from(self.index, position)[1:]
+
+    def put(self, url, content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        url_bytes = url.encode("utf-8")
+        body = zlib.compress(content)
+        record = RECORD_HEADER.pack(len(url_bytes), len(body)) + url_bytes + body
+        key = content_key(url)
+        with self.lock:
+            offset = self.segment_file.tell()
+            if offset and offset + len(record) > self.segment_size:
+                self.segment_file.close()
+                self.segment += 1
+                self.segment_file = open(self._segment_path(self.segment), "ab")
+                offset = 0
+            self.segment_file.write(record)
+            self._insert(key, self.segment, offset, len(record))
+
+    def get(self, url):
+        location = self._lookup(content_key(url))
+        if location is None:
+            return None
+        segment, offset, length = location
+        with self.lock:
+            if segment == self.segment:
+                self.segment_file.flush()
+            view = self._map(segment, offset + length)
+            if view is None:
+                # Indexed, but the record never reached its segment
+                # before a crash.
+                return None
+            record = view[offset:offset + length]
+        url_length, body_length = RECORD_HEADER.unpack_from(record)
+        body = record[RECORD_HEADER.size + url_length:]
+        return zlib.decompress(body).decode("utf-8", errors="ignore")
+
+    def _map(self, segment, needed):
+        view = self.maps.get(segment)
+        if view is None or len(view) < needed:
+            # The active segment grows, so remap it when reading past the end.
+            path = self._segment_path(segment)
+            if not os.path.exists(path) or os.path.getsize(path) < needed:
+                return None
+            if view is not None:
+                view.close()
+            with open(path, "rb") as f:
+                view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = view
+        return view
+
+    def flush(self):
+        with self.lock:
+            self.segment_file.flush()
+            self.index.flush()
+
+    def close(self):
+        with self.lock:
+            for view in self.maps.values():
+                view.close()
+            self.maps.clear()
+            self.segment_file.close()
+            self._close_index()
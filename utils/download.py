@@ -1,21 +1,86 @@
 import requests
 import cbor
 import time
+import threading
 
+from requests.adapters import HTTPAdapter
+from utils.metrics import metrics
 from utils.response import Response
 
+# Reported when the cache server could not be reached at all. The cache
+# server itself only uses 600-606.
+UNREACHABLE_STATUS = 607
+# Cache server answers worth retrying.
+RETRY_STATUSES = {500, 502, 503, 504}
+
+_local = threading.local()
+DOWNLOAD_STATS = ("requests", "retries", "timeouts", "failures")
+
+def record_stat(stat):
+    metrics.inc(f"download_{stat}")
+
+def get_download_stats():
+    return {stat: metrics.counter(f"download_{stat}").value for stat in DOWNLOAD_STATS}
+
+def get_session(config):
+    # Sessions are not safe to share between threads, so each thread keeps
+    # its own keep-alive connection pool to the cache server.
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.pool_size)
+        session.mount("http://", adapter)
+        _local.session = session
+    return session
+
 def download(url, config, logger=None):
     host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+    session = get_session(config)
+    resp = None
+    error = None
+    for attempt in range(config.download_retries + 1):
+        if attempt:
+            record_stat("retries")
+            time.sleep(config.retry_backoff * 2 ** (attempt - 1))
+        record_stat("requests")
+        try:
+            with metrics.time("cache_request"):
+                resp = session.get(
+                    f"http://{host}:{port}/",
+                    params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+                    timeout=(config.connect_timeout, config.read_timeout))
+        except requests.Timeout as e:
+            record_stat("timeouts")
+            resp, error = None, e
+            continue
+        except requests.ConnectionError as e:
+            resp, error = None, e
+            continue
+        if resp.status_code not in RETRY_STATUSES:
+            break
+    if resp is None:
+        return unreachable_response(url, error, logger)
+    return build_response(
+        url, resp.status_code, resp.content, logger, config.max_page_size)
+
+def unreachable_response(url, error, logger=None):
+    record_stat("failures")
+    if logger:
+        logger.error(f"Cache server unreachable for url {url}: {error}.")
+    return Response({
+        "error": f"Cache server unreachable: {error}.",
+        "status": UNREACHABLE_STATUS,
+        "url": url})
+
+def build_response(url, status_code, content, logger=None, max_size=0):
     try:
-        if resp and resp.content:
-            return Response(cbor.loads(resp.content))
+        if status_code < 400 and content:
+            return Response(cbor.loads(content), max_size)
     except (EOFError, ValueError) as e:
         pass
-    logger.error(f"Spacetime Response error {resp} with url {url}.")
+    if logger:
+        logger.error(f"Spacetime Response error <{status_code}> with url {url}.")
     return Response({
-        "error": f"Spacetime Response error {resp} with url {url}.",
-        "status": resp.status_code,
+        "error": f"Spacetime Response error <{status_code}> with url {url}.",
+        "status": status_code,
         "url": url})
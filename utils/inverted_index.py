@@ -0,0 +1,333 @@
+import heapq
+import math
+import mmap
+import os
+import shutil
+import struct
+import threading
+
+# Fixed-width entry of the dictionary index: offset of a dictionary record.
+DICTIONARY_OFFSET = struct.Struct("<Q")
+# Bytes charged per term of an in-memory block on top of its text and
+# postings: dict slot, list and bytearray headers.
+TERM_OVERHEAD = 160
+
+
+def encode_varint(number, out):
+    while number >= 0x80:
+        out.append((number & 0x7F) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def decode_varint(data, position):
+    number = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, position
+        shift += 7
+
+
+def read_varint(f):
+    number = shift = 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            raise EOFError
+        number |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return number
+        shift += 7
+
+
+def decode_postings(data):
+    ''' [(doc_id, term_frequency)] from gap-encoded varints. '''
+    postings = list()
+    doc_id = position = 0
+    while position < len(data):
+        gap, position = decode_varint(data, position)
+        frequency, position = decode_varint(data, position)
+        doc_id += gap
+        postings.append((doc_id, frequency))
+    return postings
+
+
+def _write_record(f, term, df, last_doc, payload):
+    header = bytearray()
+    term_bytes = term.encode("utf-8")
+    encode_varint(len(term_bytes), header)
+    header += term_bytes
+    encode_varint(df, header)
+    encode_varint(last_doc, header)
+    encode_varint(len(payload), header)
+    f.write(header)
+    f.write(payload)
+
+
+def _read_records(path):
+    ''' Streams (term, df, last_doc, payload) from a block in term order. '''
+    with open(path, "rb") as f:
+        while True:
+            try:
+                term_length = read_varint(f)
+            except EOFError:
+                return
+            term = f.read(term_length).decode("utf-8")
+            df = read_varint(f)
+            last_doc = read_varint(f)
+            payload = f.read(read_varint(f))
+            yield term, df, last_doc, payload
+
+
+def _numbered_records(path, number):
+    # The block number orders a term's records from different blocks.
+    for term, df, last_doc, payload in _read_records(path):
+        yield term, number, df, last_doc, payload
+
+
+class IndexBuilder(object):
+    ''' SPIMI inverted index builder fed with the token counts of crawled
+    pages.
+
+    Postings are kept per term as gap-encoded varints in an in-memory
+    block. When the block outgrows memory_limit bytes it is spilled as a
+    sorted partial index, a block file. finish() k-way merges the blocks
+    into postings.dat (the compressed postings lists, back to back),
+    dictionary.dat (term, document frequency, postings offset and length)
+    and dictionary.idx (fixed-width offsets of the sorted dictionary
+    records, for binary search). docs.txt maps doc ids to urls. '''
+
+    def __init__(self, directory, memory_limit=64 * 1024 * 1024, restart=False):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.lock = threading.Lock()
+        if restart and os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory, exist_ok=True)
+        self.blocks = sorted(
+            name for name in os.listdir(directory)
+            if name.startswith("block-") and name.endswith(".dat"))
+        docs_path = os.path.join(directory, "docs.txt")
+        self.doc_count = 0
+        if os.path.exists(docs_path):
+            with open(docs_path, "rb") as f:
+                self.doc_count = sum(1 for _ in f)
+        self.docs_file = open(docs_path, "a", encoding="utf-8")
+        self._new_block()
+
+    def _new_block(self):
+        # term -> [gap-encoded postings, last doc id, document frequency]
+        self.block = dict()
+        self.block_size = 0
+
+    def add(self, url, tokens):
+        ''' Indexes a page given its {term: frequency} counts. '''
+        if not tokens:
+            return
+        with self.lock:
+            doc_id = self.doc_count
+            self.doc_count += 1
+            self.docs_file.write(url + "\n")
+            block = self.block
+            for term, frequency in tokens.items():
+                entry = block.get(term)
+                if entry is None:
+                    entry = block[term] = [bytearray(), 0, 0]
+                    self.block_size += TERM_OVERHEAD + len(term)
+                postings = entry[0]
+                size = len(postings)
+                encode_varint(doc_id - entry[1], postings)
+                encode_varint(frequency, postings)
+                self.block_size += len(postings) - size
+                entry[1] = doc_id
+                entry[2] += 1
+            if self.block_size >= self.memory_limit:
+                self._spill_locked()
+
+    def spill(self):
+        ''' Writes the in-memory block out, e.g. at an analyzer checkpoint
+        so a crash loses at most the pages since then. '''
+        with self.lock:
+            self._spill_locked()
+
+    def _spill_locked(self):
+        self.docs_file.flush()
+        if not self.block:
+            return
+        name = f"block-{len(self.blocks):05d}.dat"
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "wb") as f:
+            for term in sorted(self.block):
+                postings, last_doc, df = self.block[term]
+                _write_record(f, term, df, last_doc, postings)
+        os.replace(path + ".tmp", path)
+        self.blocks.append(name)
+        self._new_block()
+
+    def finish(self):
+        ''' Spills the last block and merges all blocks into the index. '''
+        with self.lock:
+            self._spill_locked()
+            self._merge_locked()
+
+    def _merge_locked(self):
+        # Blocks hold increasing doc ids, so a term's postings are the
+        # concatenation of its block postings in block order; only the
+        # first gap of each continuation is rebased.
+        streams = [
+            _numbered_records(os.path.join(self.directory, name), number)
+            for number, name in enumerate(self.blocks)]
+        paths = {
+            name: os.path.join(self.directory, name + ".tmp")
+            for name in ("postings.dat", "dictionary.dat", "dictionary.idx")}
+        with open(paths["postings.dat"], "wb") as postings_file, \
+                open(paths["dictionary.dat"], "wb") as dictionary_file, \
+                open(paths["dictionary.idx"], "wb") as index_file:
+            current = None
+            for term, _, df, last_doc, payload in heapq.merge(*streams):
+                if term != current:
+                    if current is not None:
+                        self._write_term(
+                            current, merged, postings_file,
+                            dictionary_file, index_file)
+                    current = term
+                    merged = [bytearray(), 0, 0]
+                if merged[2]:
+                    first_doc, position = decode_varint(payload, 0)
+                    rebased = bytearray()
+                    encode_varint(first_doc - merged[1], rebased)
+                    merged[0] += rebased
+                    merged[0] += payload[position:]
+                else:
+                    merged[0] += payload
+                merged[1] = last_doc
+                merged[2] += df
+            if current is not None:
+                self._write_term(
+                    current, merged, postings_file, dictionary_file, index_file)
+        for name, path in paths.items():
+            os.replace(path, os.path.join(self.directory, name))
+
+    def _write_term(self, term, merged, postings_file, dictionary_file, index_file):
+        postings, _, df = merged
+        index_file.write(DICTIONARY_OFFSET.pack(dictionary_file.tell()))
+        record = bytearray()
+        term_bytes = term.encode("utf-8")
+        encode_varint(len(term_bytes), record)
+        record += term_bytes
+        encode_varint(df, record)
+        encode_varint(postings_file.tell(), record)
+        encode_varint(len(postings), record)
+        dictionary_file.write(record)
+        postings_file.write(postings)
+
+    def close(self):
+        with self.lock:
+            self._spill_locked()
+            self.docs_file.close()
+
+
+class InvertedIndex(object):
+    ''' Read side of an index written by IndexBuilder.finish(). The
+    dictionary and postings are memory-mapped; lookups binary search the
+    dictionary through its offset index. A url indexed again after a
+    recrawl only matches through its latest document. '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "docs.txt"), encoding="utf-8") as f:
+            self.docs = [line.rstrip("\n") for line in f]
+        self.latest = {url: doc_id for doc_id, url in enumerate(self.docs)}
+        self.files = list()
+        self.postings = self._map("postings.dat")
+        self.dictionary = self._map("dictionary.dat")
+        self.offsets = self._map("dictionary.idx")
+        self.term_count = len(self.offsets) // DICTIONARY_OFFSET.size
+
+    def _map(self, name):
+        f = open(os.path.join(self.directory, name), "rb")
+        self.files.append(f)
+        if not os.fstat(f.fileno()).st_size:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.term_count
+
+    def _entry(self, number):
+        offset, = DICTIONARY_OFFSET.unpack_from(
+            self.offsets, number * DICTIONARY_OFFSET.size)
+        length, position = decode_varint(self.dictionary, offset)
+        term = self.dictionary[position:position + length].decode("utf-8")
+        position += length
+        df, position = decode_varint(self.dictionary, position)
+        postings_offset, position = decode_varint(self.dictionary, position)
+        postings_length, position = decode_varint(self.dictionary, position)
+        return term, df, postings_offset, postings_length
+
+    def _find(self, term):
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._entry(middle)
+            if entry[0] < term:
+                low = middle + 1
+            elif entry[0] > term:
+                high = middle
+            else:
+                return entry
+        return None
+
+    def _postings(self, offset, length):
+        return [
+            (doc_id, frequency)
+            for doc_id, frequency in decode_postings(
+                self.postings[offset:offset + length])
+            if self.latest[self.docs[doc_id]] == doc_id]
+
+    def lookup(self, term):
+        ''' [(url, term_frequency)] of the pages containing term. '''
+        entry = self._find(term.lower())
+        if entry is None:
+            return []
+        _, _, offset, length = entry
+        return [
+            (self.docs[doc_id], frequency)
+            for doc_id, frequency in self._postings(offset, length)]
+
+    def search(self, query, limit=10):
+        ''' Pages containing every word of query, best tf-idf first, as
+        [(url, score)]. '''
+        scores = None
+        for term in query.lower().split():
+            entry = self._find(term)
+            if entry is None:
+                return []
+            _, _, offset, length = entry
+            postings = self._postings(offset, length)
+            if not postings:
+                return []
+            idf = math.log(len(self.latest) / len(postings))
+            term_scores = {
+                doc_id: (1 + math.log(frequency)) * idf
+                for doc_id, frequency in postings}
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {
+                    doc_id: score + term_scores[doc_id]
+                    for doc_id, score in scores.items() if doc_id in term_scores}
+        if not scores:
+            return []
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(self.docs[doc_id], score) for doc_id, score in best]
+
+    def close(self):
+        for view in (self.postings, self.dictionary, self.offsets):
+            if isinstance(view, mmap.mmap):
+                view.close()
+        for f in self.files:
+            f.close()
@@ -0,0 +1,256 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the latency buckets in seconds, 10us to about 20 minutes.
+BUCKETS = [1e-5 * 2 ** i for i in range(27)]
+
+
+class Counter(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Gauge(object):
+    ''' A value that is set, or read from function when rendered. '''
+    def __init__(self, function=None):
+        self.function = function
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:
+                return None
+        return self._value
+
+
+class Histogram(object):
+    ''' Latencies in fixed exponential buckets: constant memory, and an
+    observation is a bisect and a few additions. Quantiles are the upper
+    bound of their bucket, so within a factor of 2. '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        index = bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.buckets[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, fraction):
+        with self.lock:
+            rank = fraction * self.count
+            seen = 0
+            for index, count in enumerate(self.buckets):
+                seen += count
+                if count and seen >= rank:
+                    if index < len(BUCKETS):
+                        return min(BUCKETS[index], self.max)
+                    return self.max
+            return 0.0
+
+    def snapshot(self):
+        with self.lock:
+            count, total, largest = self.count, self.total, self.max
+        return {
+            "count": count,
+            "mean": total / count if count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": largest}
+
+
+class Timer(object):
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class LockTimer(object):
+    ''' Context manager for a lock that records how long acquiring it
+    took. Holds no per-use state, so threads can share one. '''
+    __slots__ = ("lock", "histogram")
+
+    def __init__(self, lock, histogram):
+        self.lock = lock
+        self.histogram = histogram
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.lock.acquire()
+        self.histogram.observe(time.perf_counter() - start)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+class Metrics(object):
+    ''' Process-wide counters, gauges and latency histograms.
+
+    Everything is cheap enough to stay on: a timed stage costs two clock
+    reads and one short lock. The text from render() is served over HTTP
+    on METRICS_PORT and written to METRICS_FILE every METRICS_INTERVAL
+    seconds. '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict()
+        self.gauges = dict()
+        self.histograms = dict()
+        self.started = time.time()
+        self.server = None
+        self.stop_event = threading.Event()
+        self.writer = None
+        self.path = None
+
+    def _get(self, table, name, factory):
+        metric = table.get(name)
+        if metric is None:
+            with self.lock:
+                metric = table.get(name)
+                if metric is None:
+                    metric = table[name] = factory()
+        return metric
+
+    def counter(self, name):
+        return self._get(self.counters, name, Counter)
+
+    def gauge(self, name, function=None):
+        gauge = self._get(self.gauges, name, Gauge)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name):
+        return self._get(self.histograms, name, Histogram)
+
+    def inc(self, name, amount=1):
+        self.counter(name).inc(amount)
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    def time(self, name):
+        ''' with metrics.time("stage"): ... records the block's latency. '''
+        return Timer(self.histogram(name))
+
+    def timed_lock(self, lock, name):
+        ''' Use in place of `with lock:` to record lock wait time. '''
+        return LockTimer(lock, self.histogram(name))
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = dict(self.histograms)
+        return {
+            "uptime": time.time() - self.started,
+            "counters": {name: c.value for name, c in sorted(counters.items())},
+            "gauges": {name: g.value for name, g in sorted(gauges.items())},
+            "histograms": {
+                name: h.snapshot() for name, h in sorted(histograms.items())}}
+
+    def render(self):
+        snapshot = self.snapshot()
+        lines = [f"uptime_seconds {snapshot['uptime']:.1f}"]
+        for name, value in snapshot["counters"].items():
+            lines.append(f"counter {name} {value}")
+        for name, value in snapshot["gauges"].items():
+            lines.append(f"gauge {name} {value}")
+        for name, stats in snapshot["histograms"].items():
+            lines.append(
+                f"histogram {name} count {stats['count']} "
+                f"mean {stats['mean'] * 1000:.3f}ms "
+                f"p50 {stats['p50'] * 1000:.3f}ms "
+                f"p99 {stats['p99'] * 1000:.3f}ms "
+                f"max {stats['max'] * 1000:.3f}ms")
+        return "\n".join(lines) + "\n"
+
+    def start(self, config):
+        if config.metrics_port > 0 and self.server is None:
+            self.server = MetricsServer(self, config.metrics_port)
+            threading.Thread(
+                target=self.server.serve_forever, daemon=True).start()
+        if config.metrics_file and self.writer is None:
+            self.path = config.metrics_file
+            self.stop_event.clear()
+            self.writer = threading.Thread(
+                target=self._write_loop, args=(config.metrics_interval,),
+                daemon=True)
+            self.writer.start()
+
+    def _write_loop(self, interval):
+        while not self.stop_event.wait(interval):
+            self.write()
+
+    def write(self):
+        if self.path:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as f:
+                f.write(self.render())
+            os.replace(temp_path, self.path)
+
+    def stop(self):
+        if self.writer is not None:
+            self.stop_event.set()
+            self.writer.join()
+            self.writer = None
+            self.write()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, metrics, port):
+        # Local only: the endpoint is for whoever runs the crawl.
+        super().__init__(("127.0.0.1", port), MetricsRequestHandler)
+        self.metrics = metrics
+
+
+metrics = Metrics()
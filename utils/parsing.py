@@ -0,0 +1,78 @@
+import re
+from collections import Counter, namedtuple
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+from utils.simhash import simhash
+
+STOPWORDS = frozenset("a about above after again against all am an and any are aren't as at be because been before being below between both but by can't cannot could couldn't did didn't do does doesn't doing don't down during each few for from further had hadn't has hasn't have haven't having he he'd he'll he's her here here's hers herself him himself his how how's i i'd i'll i'm i've if in into is isn't it it's its itself let's me more most mustn't my myself no nor not of off on once only or other ought our ours ourselves out over own same shan't she she'd she'll she's should shouldn't so some such than that that's the their theirs them themselves then there there's these they they'd they'll they're they've this those through to under until up very was wasn't we we'd we'll we're we've were weren't what what's when when's where where's which while who who's whom why why's with won't would wouldn't you you'd you'll you're you've your yours yourself yourselves".split())
+
+WORD_PATTERN = re.compile(r"\b[a-zA-Z]+\b")
+
+# Elements whose text is never shown on the page.
+INVISIBLE_TAGS = {"script", "style", "noscript", "template"}
+
+# Result of the single parse of a page, shared by the scraper (links) and
+# the analyzer (word_count, tokens, fingerprint). tokens counts the
+# non-stopword words, fingerprint is their SimHash.
+ParsedPage = namedtuple(
+    "ParsedPage", ["links", "word_count", "tokens", "fingerprint"])
+
+
+class PageParser(HTMLParser):
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.links = list()
+        self.text = list()
+        self.invisible_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            for name, value in attrs:
+                if name == "href" and value:
+                    self.links.append(urljoin(self.base_url, value.strip()))
+                    break
+        elif tag in INVISIBLE_TAGS:
+            self.invisible_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in INVISIBLE_TAGS and self.invisible_depth:
+            self.invisible_depth -= 1
+
+    def handle_data(self, data):
+        if not self.invisible_depth:
+            self.text.append(data)
+
+
+def parse_html(html, base_url):
+    parser = PageParser(base_url)
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception as e:
+        print(f"error in parsing page, {e}")
+    words = WORD_PATTERN.findall(" ".join(parser.text).lower())
+    tokens = Counter(
+        word for word in words if len(word) > 2 and word not in STOPWORDS)
+    return ParsedPage(parser.links, len(words), tokens, simhash(tokens))
+
+
+def parse_bytes(content, base_url, encoding="utf-8"):
+    try:
+        html = content.decode(encoding, errors="ignore")
+    except LookupError:
+        html = content.decode("utf-8", errors="ignore")
+    return parse_html(html, base_url)
+
+
+def has_body(resp):
+    return resp.has_page()
+
+
+def parse_response(resp):
+    ''' Parses a downloaded page, decoded once by the response. Returns
+    None for responses without a usable HTML body. '''
+    if not has_body(resp):
+        return None
+    return parse_html(resp.text, resp.url)
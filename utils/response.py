@@ -1,14 +1,101 @@
 import pickle
 
+# Content types the crawler parses. A missing header is given the benefit
+# of the doubt.
+HTML_CONTENT_TYPES = {"", "text/html", "application/xhtml+xml", "text/plain"}
+
+_UNSET = object()
+
 class Response(object):
-    def __init__(self, resp_dict):
+    ''' Response of the cache server.
+
+    The pickled requests.Response is kept as received and only unpickled
+    when raw_response is first used, and the body is only decoded when
+    text is first used. has_page() rejects oversized, failed and non-HTML
+    responses before either happens. max_size is in bytes, 0 for no
+    limit. '''
+    def __init__(self, resp_dict, max_size=0):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.error = resp_dict["error"] if "error" in resp_dict else None
-        try:
-            self.raw_response = (
-                pickle.loads(resp_dict["response"])
-                if "response" in resp_dict else
-                None)
-        except TypeError:
-            self.raw_response = None
+        self.payload = resp_dict.get("response")
+        self.max_size = max_size
+        self._raw_response = _UNSET
+        self._text = None
+
+    @property
+    def raw_response(self):
+        if self._raw_response is _UNSET:
+            try:
+                self._raw_response = (
+                    pickle.loads(self.payload)
+                    if self.payload is not None else
+                    None)
+            except (TypeError, pickle.UnpicklingError, EOFError):
+                self._raw_response = None
+        return self._raw_response
+
+    @property
+    def content(self):
+        ''' The body as bytes, or None. '''
+        raw_response = self.raw_response
+        return raw_response.content if raw_response is not None else None
+
+    @property
+    def body(self):
+        ''' Zero-copy view of the body. '''
+        content = self.content
+        return memoryview(content) if content is not None else None
+
+    def _header(self, name):
+        headers = getattr(self.raw_response, "headers", None)
+        return headers.get(name, "") if headers else ""
+
+    @property
+    def content_type(self):
+        return self._header("Content-Type").split(";")[0].strip().lower()
+
+    @property
+    def etag(self):
+        return self._header("ETag").strip()
+
+    @property
+    def last_modified(self):
+        return self._header("Last-Modified").strip()
+
+    @property
+    def encoding(self):
+        for param in self._header("Content-Type").split(";")[1:]:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "charset" and value.strip():
+                return value.strip().strip('"')
+        return "utf-8"
+
+    @property
+    def text(self):
+        ''' The body decoded once. '''
+        if self._text is None:
+            content = self.content or b""
+            try:
+                self._text = content.decode(self.encoding, errors="ignore")
+            except LookupError:
+                self._text = content.decode("utf-8", errors="ignore")
+        return self._text
+
+    def too_large(self, size):
+        return bool(self.max_size) and size > self.max_size
+
+    def has_page(self):
+        ''' Whether this is a successful HTML page worth parsing. Checked
+        from the cheapest fact to the most expensive. '''
+        if self.status != 200 or not self.payload:
+            return False
+        # The body is most of the pickle, so a pickle of more than twice
+        # the limit is rejected without being unpickled.
+        if self.too_large(len(self.payload) // 2):
+            return False
+        if self.raw_response is None or not self.content:
+            return False
+        if self.too_large(len(self.content)):
+            return False
+        return self.content_type in HTML_CONTENT_TYPES
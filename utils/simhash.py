@@ -0,0 +1,89 @@
+import struct
+from functools import lru_cache
+from hashlib import blake2b
+
+FINGERPRINT_BITS = 64
+# Width of each per-bit counter in simhash(); a page would need 2**32
+# words to overflow one.
+COUNTER_BITS = 32
+COUNTERS = struct.Struct(f"<{FINGERPRINT_BITS}I")
+# Pages with fewer distinct tokens get no fingerprint; their fingerprints
+# are too unstable to compare.
+MIN_FINGERPRINT_TOKENS = 5
+
+
+def token_hash(token):
+    return int.from_bytes(
+        blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+@lru_cache(maxsize=1 << 16)
+def token_bits(token):
+    # The token hash with every bit widened to a COUNTER_BITS field, so one
+    # multiply-add counts a token into all 64 per-bit counters at once.
+    value = token_hash(token)
+    spread = 0
+    for bit in range(FINGERPRINT_BITS):
+        if value >> bit & 1:
+            spread |= 1 << (bit * COUNTER_BITS)
+    return spread
+
+
+def simhash(tokens):
+    ''' 64-bit SimHash of a Counter of tokens, weighted by count. '''
+    if len(tokens) < MIN_FINGERPRINT_TOKENS:
+        return None
+    # counters holds, per bit, the total count of the tokens with that bit
+    # set. A bit's weight is positive when that is over half of all counts.
+    counters = total = 0
+    for token, count in tokens.items():
+        counters += count * token_bits(token)
+        total += count
+    fields = COUNTERS.unpack(counters.to_bytes(COUNTERS.size, "little"))
+    fingerprint = 0
+    for bit, field in enumerate(fields):
+        if 2 * field > total:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex(object):
+    ''' Finds fingerprints within max_distance bits of a query.
+
+    Fingerprints are split into max_distance + 1 bands. Two fingerprints
+    that differ in at most max_distance bits agree on at least one whole
+    band, so only fingerprints sharing a band bucket are compared. A
+    negative max_distance disables the index: it keeps and finds nothing. '''
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self.band_count = max(0, max_distance + 1)
+        self.band_width = -(-FINGERPRINT_BITS // max(1, self.band_count))
+        self.band_mask = (1 << self.band_width) - 1
+        self.buckets = [dict() for _ in range(self.band_count)]
+
+    def _bands(self, fingerprint):
+        for band in range(self.band_count):
+            yield band, fingerprint >> (band * self.band_width) & self.band_mask
+
+    def find(self, fingerprint):
+        for band, value in self._bands(fingerprint):
+            for other, url in self.buckets[band].get(value, ()):
+                if hamming_distance(fingerprint, other) <= self.max_distance:
+                    return url
+        return None
+
+    def entries(self):
+        # Every fingerprint is in exactly one bucket of each band.
+        if not self.buckets:
+            return
+        for bucket in self.buckets[0].values():
+            yield from bucket
+
+    def add(self, fingerprint, url):
+        for band, value in self._bands(fingerprint):
+            self.buckets[band].setdefault(value, []).append((fingerprint, url))
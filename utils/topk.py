@@ -0,0 +1,76 @@
+import math
+from heapq import heappop, heappush, heapreplace
+
+
+class SpaceSaving(object):
+    ''' Bounded-memory replacement for Counter when only the most common
+    items are needed (Metwally et al., Space-Saving).
+
+    At most `capacity` items are tracked. An untracked item evicts the
+    least counted one and inherits its count, so every count over-estimates
+    the true count by at most total / capacity, and every item whose true
+    count is above that is tracked. '''
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = dict()
+        self.total = 0
+        # One (count, item) entry per tracked item. Increments do not touch
+        # the heap, so entries can be stale and are fixed when they surface.
+        self.heap = list()
+        # Over-count bound: the largest count an evicted item handed on,
+        # plus the bounds of the summaries merged in.
+        self.eviction_error = 0
+        self.merged_error = 0
+
+    @classmethod
+    def for_error(cls, error):
+        ''' Sized so that two levels of merging (per-thread summaries into a
+        total) over-count by at most error * total. '''
+        return cls(math.ceil(2 / error))
+
+    def __len__(self):
+        return len(self.counts)
+
+    def items(self):
+        return self.counts.items()
+
+    def update(self, counts, error=0):
+        ''' Adds a Counter, a dict, or another summary. error is the
+        over-count bound of counts when it is not a summary. '''
+        if isinstance(counts, SpaceSaving):
+            error = counts.error_bound()
+        self.merged_error += error
+        for item, count in counts.items():
+            self.add(item, count)
+
+    def add(self, item, count=1):
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = count
+            heappush(self.heap, (count, item))
+            return
+        minimum, evicted = self._pop_min()
+        self.eviction_error = max(self.eviction_error, minimum)
+        del self.counts[evicted]
+        self.counts[item] = minimum + count
+        heappush(self.heap, (minimum + count, item))
+
+    def _pop_min(self):
+        while True:
+            count, item = self.heap[0]
+            if self.counts[item] == count:
+                return heappop(self.heap)
+            heapreplace(self.heap, (self.counts[item], item))
+
+    def most_common(self, n=None):
+        ranked = sorted(self.counts.items(), key=lambda item: -item[1])
+        return ranked if n is None else ranked[:n]
+
+    def error_bound(self):
+        ''' How much any count can be too high, across every level of
+        merging. At most total / capacity per level. '''
+        return self.eviction_error + self.merged_error